@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Search of duplicated contacts and merge of them, for use it in main.py.
+Candidate pairs come from blocking keys (phone, email, name prefix) and
+MinHash LSH over name and address, so all pairs are never compared.
+Too big blocks are searched by sorted neighborhood instead of all pairs.
+"""
+import re
+import zlib
+import itertools
+import unicodedata
+from collections import Counter
+from utils import AddressBook
+from utils import Record
+from utils import normalize_phone
+
+MERGE_FIELDS = ("phone", "birthday", "address", "email")
+
+
+def fold(text: str):
+    """ Lowercase text without accents and punctuation
+    :param text: any text
+    :type text: str
+    :rtype: str
+    """
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+def shingles(text: str, size: int = 3):
+    """ Set of character n-grams of text
+    :param text: folded text
+    :type text: str
+    :param size: length of n-gram
+    :type size: int
+    :rtype: set
+    """
+    text = f" {text} "
+    return {text[_:_ + size] for _ in range(max(len(text) - size + 1, 1))}
+
+
+def jaccard(first: set, second: set):
+    """ Jaccard similarity of two sets
+    :rtype: float
+    """
+    if not first and not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class Deduplicator:
+    """ Finds candidate duplicates in near linear time.
+    MinHash signature uses one permutation hashing: every shingle hash goes
+    to one of BINS bins and the minimum of every bin is kept, empty bins are None.
+    Signature is split into BANDS bands, records with equal band having at least
+    MIN_FILLED not empty bins are candidates. Shingles which most of records have
+    (like "str" of street) are left out of signature, otherwise they make all
+    signatures alike.
+    """
+
+    BINS = 32
+    BANDS = 8
+    MIN_FILLED = 2
+    THRESHOLD = 0.5
+    # all pairs of bigger buckets are too many: name buckets are split by longer
+    # prefix, records of other ones are sorted by text and compared with WINDOW next ones
+    MAX_BUCKET = 50
+    WINDOW = 10
+    PREFIX_LEN = 4
+    # share of records which makes shingle too common for signature
+    COMMON_SHARE = 0.01
+
+    def __init__(self, contacts: AddressBook):
+        self.contacts = contacts
+
+    @staticmethod
+    def _text(record: Record):
+        address = record.address.value if record.address is not None else ""
+        return fold(f"{record.name.value} {address}")
+
+    def signature(self, grams: set):
+        """ MinHash signature of shingles
+        :param grams: shingles of text
+        :type grams: set
+        :rtype: tuple
+        """
+        bins = [None] * self.BINS
+        for gram in grams:
+            # crc32 instead of hash() keeps candidates the same between runs
+            value = zlib.crc32(gram.encode("utf-8", "surrogatepass"))
+            index, value = value % self.BINS, value // self.BINS
+            if bins[index] is None or value < bins[index]:
+                bins[index] = value
+        return tuple(bins)
+
+    def _blocking_keys(self, record: Record, grams: set):
+        """ Keys which put record in the same bucket with its possible duplicates
+        :param record: contact
+        :type record: Record
+        :param grams: not too common shingles of name and address
+        :type grams: set
+        """
+        if record.phone is not None and normalize_phone(str(record.phone.value)):
+            yield "phone", normalize_phone(str(record.phone.value))
+        if record.email is not None and record.email.value:
+            yield "email", str(record.email.value).strip().lower()
+        name = fold(record.name.value).replace(" ", "")
+        if name:
+            yield "name", name[:self.PREFIX_LEN]
+        signature = self.signature(grams)
+        rows = self.BINS // self.BANDS
+        for band in range(self.BANDS):
+            values = signature[band * rows:(band + 1) * rows]
+            if sum(_ is not None for _ in values) >= self.MIN_FILLED:
+                yield f"band{band}", values
+
+    def _block_pairs(self, kind, names, texts, length=PREFIX_LEN):
+        """ Pairs of records of one block to compare
+        :param kind: kind of blocking key
+        :type kind: str
+        :param names: names of records in block
+        :type names: list
+        :param texts: folded name and address of every record
+        :type texts: dict
+        :param length: length of name prefix of name block
+        :type length: int
+        """
+        if len(names) <= self.MAX_BUCKET:
+            yield from itertools.combinations(names, 2)
+            return
+        if kind == "name":
+            folded = {name: fold(name).replace(" ", "") for name in names}
+            longest = max(len(_) for _ in folded.values())
+            while length < longest:
+                length += 1
+                blocks = {}
+                for name in names:
+                    blocks.setdefault(folded[name][:length], []).append(name)
+                if len(blocks) > 1:
+                    for block in blocks.values():
+                        yield from self._block_pairs(kind, block, texts, length)
+                    return
+        ordered = sorted(names, key=lambda name: (texts[name], name))
+        for i, first in enumerate(ordered):
+            for second in ordered[i + 1:i + 1 + self.WINDOW]:
+                yield first, second
+
+    def candidates(self):
+        """ Pairs of probably duplicated contacts
+        :return: list of (score, first name, second name, reasons), the most similar first
+        :rtype: list
+        """
+        buckets = {}
+        with self.contacts.read():
+            texts = {name: self._text(record) for name, record in self.contacts.data.items()}
+            grams = {name: shingles(text) for name, text in texts.items()}
+            frequency = Counter(gram for _ in grams.values() for gram in _)
+            limit = max(self.MAX_BUCKET, len(grams) * self.COMMON_SHARE)
+            common = {gram for gram, count in frequency.items() if count > limit}
+            for name, record in self.contacts.data.items():
+                for key in self._blocking_keys(record, grams[name] - common):
+                    buckets.setdefault(key, []).append(name)
+        pairs = {}
+        for (kind, _), names in buckets.items():
+            for first, second in self._block_pairs(kind, names, texts):
+                pairs.setdefault(tuple(sorted((first, second))), set()).add(kind)
+        result = []
+        for (first, second), kinds in pairs.items():
+            similarity = jaccard(grams[first], grams[second])
+            reasons = [f"same {_}" for _ in ("phone", "email") if _ in kinds]
+            if not reasons and similarity < self.THRESHOLD:
+                continue
+            reasons.append(f"similarity {similarity:.2f}")
+            result.append((len(reasons) - 1 + similarity, first, second, reasons))
+        return sorted(result, key=lambda item: (-item[0], item[1], item[2]))
+
+
+def merge_records(keep: Record, other: Record, take=()):
+    """ Merge other record in keep: empty fields of keep are filled from other,
+    for fields in take value of other wins
+    :param keep: record which stays in address book
+    :type keep: Record
+    :param other: record which is merged
+    :type other: Record
+    :param take: fields where value of other should be used
+    :type take: tuple
+    :return: list of (field, value) which were dropped because of conflict
+    :rtype: list
+    """
+    dropped = []
+    for field in MERGE_FIELDS:
+        ours, theirs = getattr(keep, field), getattr(other, field)
+        if theirs is None:
+            continue
+        if ours is None or field in take:
+            setattr(keep, field, theirs)
+            if ours is not None and str(ours.value) != str(theirs.value):
+                dropped.append((field, ours.value))
+        elif str(ours.value) != str(theirs.value):
+            dropped.append((field, theirs.value))
+    return dropped
@@ -3,11 +3,16 @@
 Console Bot helper.
 For works with Address book
 """
+import time
+# taken before other imports, so startup time includes them
+STARTED_AT = time.perf_counter()
+import os
 import re
-import calendar
-import readline
+import sys
+import threading
 from datetime import datetime, timedelta
 from utils import input_error
+from utils import BirthdayScheduler
 from utils import Birthday
 from utils import Record
 from utils import Pickle
@@ -15,12 +20,53 @@ from utils import CommandCompleter
 from utils import Commands
 from utils import AddressBook
 from utils import Notes
+from utils import Event
+from utils import ChangeJournal
+from utils import ContactStats
+from utils import DataFileError
+from query import ContactIndex
+from query import Query
+from query import QueryError
+from sync import Replica
+from sync import ReplicaState
+from sync import synchronize
 
 TELEPHONE_NUMBER_LEN = 10
 EMAIL_MAX_LEN = 50
 FINDER_INPUT_LEN = 3
+MAINTENANCE_INTERVAL = 5
+# commands which do not need contacts, so they do not start loading of contacts
+NOTES_COMMANDS = {Commands.ADD_NOTE, Commands.ADD_TAGS, Commands.EDIT_NOTE, Commands.FIND_NOTE,
+                  Commands.DELETE_NOTE, Commands.FIND_NOTES_BY_TAGS, Commands.SORT_NOTES}
 
 pickle = Pickle()
+scheduler = BirthdayScheduler()
+contacts_index = ContactIndex()
+replica_state = ReplicaState(pickle)
+contact_stats = ContactStats()
+
+
+def _on_contact_event(event: Event):
+    """ Keep birthday scheduler, query indexes and counters in sync with changed contact
+    :param event: change of contact
+    :type event: Event
+    """
+    if event.new is None:
+        scheduler.unschedule(event.key)
+        contacts_index.remove(event.key)
+    else:
+        scheduler.schedule(event.new)
+        contacts_index.add(event.key, event.new)
+    contact_stats.update(event)
+
+
+def _attach(contacts: AddressBook):
+    """ Build birthday scheduler and query indexes for contacts, read saved counters
+    :param contacts: contacts object
+    """
+    scheduler.attach(contacts)
+    contacts_index.attach(contacts)
+    contact_stats.attach(contacts, pickle.read_contact_stats())
 
 
 @input_error
@@ -36,20 +82,22 @@ def find_contact(contacts: AddressBook, user_input: str):
     list_of_users = []
 
     if len(user_input) >= FINDER_INPUT_LEN:
-        for user_name, record in contacts.items():
-            user_info = f"Contact name: {user_name}"
-            user_info += f", {record.birthday.value}" if hasattr(
-                record, 'birthday') and record.birthday is not None else ""
-            user_info += f", phone: {record.phone.value}" if hasattr(
-                record, 'phone') and record.phone is not None else ""
-            user_info += f", address: {record.address.value}" if hasattr(
-                record, 'address') and record.address is not None else ""
-            user_info += f", email: {record.email.value}" if hasattr(
-                record, 'email') and record.email is not None else ""
-            if user_input.lower() in user_info.lower():
-                list_of_users.append(user_info)
-            else:
-                continue
+        # fields of every record are read under one lock, so edit() is never seen half done
+        with contacts.read():
+            for user_name, record in contacts.items():
+                user_info = f"Contact name: {user_name}"
+                user_info += f", {record.birthday.value}" if hasattr(
+                    record, 'birthday') and record.birthday is not None else ""
+                user_info += f", phone: {record.phone.value}" if hasattr(
+                    record, 'phone') and record.phone is not None else ""
+                user_info += f", address: {record.address.value}" if hasattr(
+                    record, 'address') and record.address is not None else ""
+                user_info += f", email: {record.email.value}" if hasattr(
+                    record, 'email') and record.email is not None else ""
+                if user_input.lower() in user_info.lower():
+                    list_of_users.append(user_info)
+                else:
+                    continue
     else:
         return f"Enter {str(FINDER_INPUT_LEN)} and more characters."
 
@@ -146,7 +194,8 @@ def change_phone(contacts: AddressBook, name: str, phone: str):
     """
     _phone = _get_phone_number(phone)
     if _phone:
-        contacts.data[name].edit_phone(phone)
+        with contacts.edit(name) as record:
+            record.edit_phone(phone)
         pickle.save_contacts(contacts)
         return f"Contact: {name} : {phone} changed"
     else:
@@ -171,10 +220,11 @@ def get_all(contacts: AddressBook):
     :return: All contacts info
     :rtype: str
     """
-    if contacts.data:
-        return '\n'.join([f"{v}" for k, v in contacts.data.items()])
-    else:
-        return "Data is empty, nothing to show"
+    with contacts.read():
+        if contacts.data:
+            return '\n'.join([f"{v}" for k, v in contacts.data.items()])
+        else:
+            return "Data is empty, nothing to show"
 
 
 @input_error
@@ -188,7 +238,8 @@ def add_address(contacts: AddressBook, name: str, *args):
     :rtype: str
     """
     address = ' '.join(args)
-    contacts.data[name].add_address(address)
+    with contacts.edit(name) as record:
+        record.add_address(address)
     pickle.save_contacts(contacts)
     return f"Address for {name} : {address} added"
 
@@ -217,7 +268,8 @@ def change_address(contacts: AddressBook, name: str, *args):
     :rtype: str
     """
     address = ' '.join(args)
-    contacts.data[name].add_address(address)
+    with contacts.edit(name) as record:
+        record.add_address(address)
     pickle.save_contacts(contacts)
     return f"Address for {name} : {address} changed"
 
@@ -236,7 +288,8 @@ def add_email(contacts: AddressBook, name: str, email: str):
     """
     _email = _get_valid_email(email)
     if _email:
-        contacts.data[name].add_email(email)
+        with contacts.edit(name) as record:
+            record.add_email(email)
         pickle.save_contacts(contacts)
         return f"Email for: {name} : {email} added"
     else:
@@ -257,7 +310,8 @@ def change_email(contacts: AddressBook, name: str, email: str):
     """
     _email = _get_valid_email(email)
     if _email:
-        contacts.data[name].edit_email(email)
+        with contacts.edit(name) as record:
+            record.edit_email(email)
         pickle.save_contacts(contacts)
         return f"Email for: {name} : {email} changed"
     else:
@@ -290,7 +344,8 @@ def add_birthday(contacts: AddressBook, name: str, birthday_date: str):
     """
     result = Birthday.convert_date(birthday_date)
     if result:
-        contacts.data[name].add_birthday(birthday_date)
+        with contacts.edit(name) as record:
+            record.add_birthday(birthday_date)
         pickle.save_contacts(contacts)
         return f"Birthday for {name} : {birthday_date} added"
     else:
@@ -309,47 +364,50 @@ def show_birthday(contacts: AddressBook, name: str):
     return contacts.data[name].get_birthday()
 
 
+def _parse_range(args):
+    """ Parse --from and --to options of birthdays command
+    :param args: command arguments
+    :type args: list
+    :return: start and end dates, next 7 days by default
+    :rtype: tuple
+    :raise ValueError: with message for user if options or dates are wrong
+    """
+    options = dict(zip(args[::2], args[1::2]))
+    if len(args) % 2 or not set(options) <= {"--from", "--to"} or len(options) * 2 != len(args):
+        raise ValueError("Use birthdays [--from DD.MM.YYYY] [--to DD.MM.YYYY]")
+    dates = {}
+    for option, value in options.items():
+        dates[option] = Birthday.convert_date(value)
+        if dates[option] is None:
+            raise ValueError(f"Date {value} of {option} should be in format DD.MM.YYYY")
+    start = dates.get("--from") or datetime.today().date()
+    end = dates.get("--to") or start + timedelta(days=6)
+    if start > end:
+        raise ValueError("Date of --from should not be later than date of --to")
+    return start, end
+
+
 @input_error
-def birthdays(contacts: AddressBook):
-    """ Method for show all birthdays in nearest 7 days if exist
+def birthdays(*args):
+    """ Method for show all birthdays from --from to --to dates, nearest 7 days by default
     :return: list of birthdays by days for cmd representation
     :rtype: str
     """
-    days_in_week = 7
+    import calendar
+    try:
+        start, end = _parse_range(args)
+    except ValueError as ex:
+        return str(ex)
     result = {}
-    today = datetime.today().date()
-    if contacts.data:
-        for user in contacts.data.values():
-            name = user.name
-            birthday = user.birthday.date_object
-            birthday_this_year = birthday.replace(year=today.year)
-            if birthday_this_year < today:
-                birthday_this_year = birthday_this_year.replace(
-                    year=today.year + 1)
-            else:
-                birthday_this_year = birthday_this_year.replace(
-                    year=today.year)
-            delta_days = (birthday_this_year - today).days
-            if delta_days < days_in_week:
-                weekday = birthday_this_year.weekday()
-                day_name = calendar.day_name[weekday]
-                if weekday in [5, 6]:
-                    day_name = calendar.day_name[0]
-                if day_name in result:
-                    result[day_name] = result[day_name] + ', ' + name
-                else:
-                    result[day_name] = name
-        week_days = [calendar.day_name[_] for _ in range(days_in_week)]
-        print_result = []
-        for weekday in week_days:
-            if weekday in result:
-                print_result.append("{}: {}".format(weekday, result[weekday]))
-        if print_result:
-            return "\n".join(print_result)
-        else:
-            return "No birthdays on next week"
+    for day, name in scheduler.between(start, end):
+        congratulation_day = BirthdayScheduler.congratulation_date(day)
+        result.setdefault(congratulation_day, []).append(name)
+    if result:
+        return "\n".join(
+            "{} {}: {}".format(calendar.day_name[day.weekday()], day.strftime(Birthday.date_format), ', '.join(names))
+            for day, names in result.items())
     else:
-        return "Empty birthday list"
+        return f"No birthdays from {start.strftime(Birthday.date_format)} to {end.strftime(Birthday.date_format)}"
 
 
 @input_error
@@ -372,18 +430,19 @@ def edit_record(contacts: AddressBook, name: str):
             >>>""")
         command, *args = parse_input(user_input)
         args = [name, *args]
-        if command == "phone":
-            return change_phone(contacts, *args)
-        elif command == "birthday":
-            return add_birthday(contacts, *args)
-        elif command == "address":
-            return change_address(contacts, *args)
-        elif command == "email":
-            return change_email(contacts, *args)
-        elif command == "back":
-            return "Returned to the main"
-        else:
-            return "Invalid command."
+        with pickle.contacts_transaction(contacts):
+            if command == "phone":
+                return change_phone(contacts, *args)
+            elif command == "birthday":
+                return add_birthday(contacts, *args)
+            elif command == "address":
+                return change_address(contacts, *args)
+            elif command == "email":
+                return change_email(contacts, *args)
+            elif command == "back":
+                return "Returned to the main"
+            else:
+                return "Invalid command."
     else:
         return "Name is not present in address book"
 
@@ -478,7 +537,7 @@ def find_notes_by_tag(notes: Notes, tag_name: str):
         for name, data in notes.find_notes_by_tag(tag_name).items():
             print(f"Note's name: {name}")
             print(f"Tags: {', '.join(data['tags'])}")
-            print(f"Text: {data['text']}\n")
+            print(f"Text: {notes.text(name)}\n")
 
 
 @input_error
@@ -492,34 +551,198 @@ def sort_notes(notes: Notes):
     for name, data in notes.sort_notes().items():
         print(f"Note's name: {name}")
         print(f"Tags: {', '.join(data['tags'])}")
-        print(f"Text: {data['text']}\n")
+        print(f"Text: {notes.text(name)}\n")
 
 
 @input_error
-def upcoming_birthday(contacts: AddressBook, n_of_days: str):
+def upcoming_birthday(n_of_days: str):
     """ Method to show all birthdays in n days if exist
     :return: names of users who has birthday in n days
     :rtype: str
     """
-    today = datetime.today().date()
-    days = timedelta(days=int(n_of_days))
-    upcoming_birthdays = today + days
-    if contacts:
-        birthdays_on_that_day = []
-        for user in contacts.values():
-            if hasattr(user, 'birthday') and user.birthday is not None:
-                birthday = user.birthday.date_object
-                birthday_this_year = birthday.replace(year=today.year)
-                if upcoming_birthdays == birthday_this_year:
-                    birthdays_on_that_day.append(str(user.name))
-        if birthdays_on_that_day:
-            formatted_date = upcoming_birthdays.strftime("%d.%m.%Y")
-            return f"{', '.join(birthdays_on_that_day)} have birthday on {formatted_date}"
-        else:
-            formatted_date = upcoming_birthdays.strftime("%d.%m.%Y")
-            return f"No birthdays on {formatted_date}"
+    upcoming_birthdays = datetime.today().date() + timedelta(days=int(n_of_days))
+    birthdays_on_that_day = [name for _, name in scheduler.between(upcoming_birthdays, upcoming_birthdays)]
+    formatted_date = upcoming_birthdays.strftime("%d.%m.%Y")
+    if birthdays_on_that_day:
+        return f"{', '.join(birthdays_on_that_day)} have birthday on {formatted_date}"
     else:
-        return "Empty birthday list"
+        return f"No birthdays on {formatted_date}"
+
+
+@input_error
+def query(*args):
+    """ Method for find contacts by query like
+    birthday.month=11 and email.domain=gmail.com sort name limit 20
+    :return: found contacts
+    :rtype: str
+    """
+    try:
+        records, _ = contacts_index.execute(Query.parse(*args))
+    except QueryError as ex:
+        return str(ex)
+    if records:
+        return '\n'.join(str(_) for _ in records)
+    else:
+        return "Match not found"
+
+
+@input_error
+def explain(*args):
+    """ Method for show how query is executed
+    :return: plan steps
+    :rtype: str
+    """
+    try:
+        _, steps = contacts_index.execute(Query.parse(*args))
+    except QueryError as ex:
+        return str(ex)
+    return '\n'.join(steps)
+
+
+@input_error
+def dedupe(contacts: AddressBook):
+    """ Method for show probably duplicated contacts
+    :param contacts: contacts object
+    :return: pairs of contacts with reasons
+    :rtype: str
+    """
+    from dedupe import Deduplicator
+    pairs = Deduplicator(contacts).candidates()
+    if pairs:
+        return '\n'.join(f"{first} <-> {second}: {', '.join(reasons)}" for _, first, second, reasons in pairs)
+    else:
+        return "No duplicates found"
+
+
+@input_error
+def merge(contacts: AddressBook, keep: str, other: str, *fields):
+    """ Method for merge other contact in keep one and delete other
+    :param contacts: contacts object
+    :param keep: name of contact which stays
+    :type keep: str
+    :param other: name of merged contact
+    :type other: str
+    :param fields: fields where value of other contact wins
+    :return: str representation of cmd
+    :rtype: str
+    """
+    from dedupe import MERGE_FIELDS
+    from dedupe import merge_records
+    if keep == other:
+        return "Contact can not be merged with itself"
+    unknown = [_ for _ in fields if _ not in MERGE_FIELDS]
+    if unknown:
+        return f"Unknown fields {', '.join(unknown)}, use {', '.join(MERGE_FIELDS)}"
+    with pickle.contacts_transaction(contacts), contacts.edit(keep) as record:
+        dropped = merge_records(record, contacts[other], fields)
+        contacts.pop(other)
+    result = f"Contact {other} merged in {keep}"
+    if dropped:
+        result += "\nNot kept: " + ', '.join(f"{field} {value}" for field, value in dropped)
+    return result
+
+
+@input_error
+def changes(contacts: AddressBook, notes: Notes, after: str = "0"):
+    """ Method for show recent changes of contacts and notes
+    :param contacts: contacts object
+    :param notes: notes object
+    :param after: show changes with bigger sequence number
+    :type after: str
+    :return: changes, the oldest first
+    :rtype: str
+    """
+    if not after.isdigit():
+        return "Sequence number should be a number"
+    events = contacts.events.tail(int(after)) + notes.events.tail(int(after))
+    if events:
+        return '\n'.join(str(_) for _ in sorted(events, key=lambda event: event.seq))
+    else:
+        return "No changes"
+
+
+def begin(contacts: AddressBook, notes: Notes):
+    """ Method for start transaction, changes are saved only on commit
+    :param contacts: contacts object
+    :param notes: notes object
+    :return: str representation of cmd
+    :rtype: str
+    """
+    if contacts.in_transaction or notes.in_transaction:
+        return "Transaction already started"
+    contacts.begin()
+    notes.begin()
+    return "Transaction started, use commit or rollback to finish it"
+
+
+def commit(contacts: AddressBook, notes: Notes):
+    """ Method for commit transaction with one save of contacts and notes
+    :param contacts: contacts object
+    :param notes: notes object
+    :return: str representation of cmd
+    :rtype: str
+    """
+    if not contacts.in_transaction:
+        return "Transaction is not started"
+    if contacts.commit():
+        pickle.save_contacts(contacts)
+    if notes.commit():
+        pickle.save_notes(notes)
+    return "Changes committed"
+
+
+def rollback(contacts: AddressBook, notes: Notes):
+    """ Method for rollback transaction
+    :param contacts: contacts object
+    :param notes: notes object
+    :return: str representation of cmd
+    :rtype: str
+    """
+    if not contacts.in_transaction:
+        return "Transaction is not started"
+    contacts.rollback()
+    notes.rollback()
+    return "Changes rolled back"
+
+
+@input_error
+def sync(contacts: AddressBook, notes: Notes, directory: str):
+    """ Method for exchange changed contacts and notes with other directory
+    :param contacts: contacts object
+    :param notes: notes object
+    :param directory: directory of other replica
+    :type directory: str
+    :return: str representation of cmd
+    :rtype: str
+    """
+    if contacts.in_transaction:
+        return "Finish transaction before sync"
+    if not os.path.isdir(directory):
+        return f"Directory {directory} is not found"
+    if os.path.samefile(directory, pickle.directory or "."):
+        return "Directory should be other than current one"
+    report, comparisons = synchronize(Replica(pickle, contacts, notes, replica_state), Replica.open(directory))
+    result = [f"{store}: {sent} sent, {received} received" for store, (sent, received) in report.items()]
+    result.append(f"{comparisons} hash comparisons")
+    return '\n'.join(result)
+
+
+def stats_contacts(contacts: AddressBook):
+    """ Method for show count of contacts per email domain, phone prefix and birthday month
+    :param contacts: contacts object
+    :return: report
+    :rtype: str
+    """
+    import calendar
+    counters = contact_stats.counters
+    result = [f"Contacts: {len(contacts)}", "Per email domain:"]
+    result.extend(f"    {domain}: {count}" for domain, count in counters[ContactStats.EMAIL_DOMAIN].most_common())
+    result.append("Per phone prefix:")
+    result.extend(f"    {prefix}: {count}" for prefix, count in counters[ContactStats.PHONE_PREFIX].most_common())
+    result.append("Birthdays per month:")
+    result.extend(f"    {calendar.month_name[month]}: {counters[ContactStats.BIRTHDAY_MONTH][month]}"
+                  for month in sorted(counters[ContactStats.BIRTHDAY_MONTH]))
+    return '\n'.join(result)
 
 
 @input_error
@@ -534,10 +757,166 @@ def parse_input(user_input):
     return cmd, *args
 
 
-@input_error
-def main():
-    """ Main method for execution, start point
+def execute(contacts: AddressBook, notes: Notes, command: str, *args):
+    """ Method for execution of one cmd command
+    :param contacts: contacts object
+    :param notes: notes object
+    :param command: cmd command
+    :type command: str
+    :return: False if user wants to exit
+    :rtype: bool
+    """
+    if command in [Commands.CLOSE, Commands.EXIT]:
+        if contacts.in_transaction:
+            print(rollback(contacts, notes))
+        print("Good bye!")
+        return False
+    elif command == Commands.HELLO:
+        print("How can I help you?")
+    elif command == Commands.ADD:
+        print(add_phone(contacts, *args))
+    elif command == Commands.PHONE:
+        print(get_phone(contacts, *args))
+    elif command == Commands.ALL:
+        print(get_all(contacts))
+    elif command == Commands.FIND:
+        print(find_contact(contacts, *args))
+    elif command == Commands.DELETE:
+        print(delete(contacts, *args))
+    elif command == Commands.ADD_BIRTHDAY:
+        print(add_birthday(contacts, *args))
+    elif command == Commands.SHOW_BIRTHDAY:
+        print(show_birthday(contacts, *args))
+    elif command == Commands.UPCOMING_BIRTHDAY:
+        print(upcoming_birthday(*args))
+    elif command == Commands.BIRTHDAYS:
+        print(birthdays(*args))
+    elif command == Commands.ADD_ADDRESS:
+        print(add_address(contacts, *args))
+    elif command == Commands.SHOW_ADDRESS:
+        print(get_address(contacts, *args))
+    elif command == Commands.ADD_EMAIL:
+        print(add_email(contacts, *args))
+    elif command == Commands.SHOW_EMAIL:
+        print(get_email(contacts, *args))
+    elif command == Commands.ADD_NOTE:
+        print(add_note(notes, *args))
+    elif command == Commands.ADD_TAGS:
+        print(add_tags(notes, *args))
+    elif command == Commands.EDIT_NOTE:
+        print(edit_note(notes, *args))
+    elif command == Commands.FIND_NOTE:
+        print(find_note(notes, *args))
+    elif command == Commands.DELETE_NOTE:
+        print(delete_note(notes, *args))
+    elif command == Commands.FIND_NOTES_BY_TAGS:
+        find_notes_by_tag(notes, *args)
+    elif command == Commands.SORT_NOTES:
+        sort_notes(notes)
+    elif command == Commands.EDIT:
+        print(edit_record(contacts, *args))
+    elif command == Commands.QUERY:
+        print(query(*args))
+    elif command == Commands.EXPLAIN:
+        print(explain(*args))
+    elif command == Commands.DEDUPE:
+        print(dedupe(contacts))
+    elif command == Commands.MERGE:
+        print(merge(contacts, *args))
+    elif command == Commands.CHANGES:
+        print(changes(contacts, notes, *args))
+    elif command == Commands.BEGIN:
+        print(begin(contacts, notes))
+    elif command == Commands.COMMIT:
+        print(commit(contacts, notes))
+    elif command == Commands.ROLLBACK:
+        print(rollback(contacts, notes))
+    elif command == Commands.SYNC:
+        print(sync(contacts, notes, *args))
+    elif command == Commands.STATS_CONTACTS:
+        print(stats_contacts(contacts))
+    else:
+        print("Invalid command.")
+    return True
+
+
+def _in_background(func, *args):
+    """ Run func in daemon thread, so event loop is not blocked
+    and unfinished work does not keep program alive on exit
+    :param func: function to run
+    :type func: callable
+    :return: future with result of func
+    :rtype: asyncio.Future
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def _set(method, value):
+        if not future.done():
+            method(value)
+
+    def _run():
+        try:
+            result = func(*args)
+        except BaseException as ex:
+            loop.call_soon_threadsafe(_set, future.set_exception, ex)
+        else:
+            loop.call_soon_threadsafe(_set, future.set_result, result)
+
+    threading.Thread(target=_run, daemon=True).start()
+    return future
+
+
+def _read_input(prompt: str):
+    """ Read user input in daemon thread, so hanging input() does not keep program alive on exit
+    :param prompt: input prompt
+    :type prompt: str
+    :return: future with user input
+    :rtype: asyncio.Future
+    """
+    return _in_background(input, prompt)
+
+
+def _sync_stores(contacts: AddressBook, notes: Notes, with_contacts: bool = True):
+    """ Merge changes made by other processes and keep scheduler up to date
+    """
+    if with_contacts:
+        pickle.refresh_contacts(contacts)
+        scheduler.advance()
+    pickle.refresh_notes(notes)
+
+
+def _setup_completion():
+    """ Import readline only when prompt is needed and set commands autocomplete
+    """
+    import readline
+    readline.set_completer(CommandCompleter(
+        Commands.all_values()).complete)
+    readline.set_completer_delims(' ')
+    readline.parse_and_bind('tab: complete')
+
+
+async def maintenance(contacts: AddressBook, notes: Notes, lock, attached):
+    """ Periodic background work between commands: merge changes of other processes,
+    advance birthday scheduler, save versions of changed records and counters of contacts
+    :param lock: asyncio.Lock shared with commands
+    :param attached: callable which tells if scheduler and indexes are built for contacts
+    """
+    import asyncio
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+        async with lock:
+            await asyncio.to_thread(_sync_stores, contacts, notes, attached())
+            if replica_state.dirty:
+                await asyncio.to_thread(replica_state.save)
+            await asyncio.to_thread(pickle.save_contact_stats, contact_stats, contacts)
+
+
+async def repl():
+    """ Asyncio REPL, commands run in worker thread under lock shared with background tasks
     """
+    import asyncio
     contacts = pickle.read_contacts()
     notes = pickle.read_notes()
     print("""Welcome to the assistant bot!
@@ -547,15 +926,21 @@ def main():
         ° phone <name>
         ° all
         ° find <name/phone/birthday/address/email> (at least 3 char)
+        ° query <field=value> [and <field=value>] [sort <field> [desc]] [limit <number>]
+        ° explain <query>
         ° add-birthday <name> <birthday(in format DD.MM.YYYY)>
         ° show-birthday <name>        
         ° upcoming-birthday <number_of_days>
+        ° birthdays [--from DD.MM.YYYY] [--to DD.MM.YYYY]
         ° add-address <name> <address>
         ° show-address <name>
         ° add-email <name> <email>
         ° show-email <name>
         ° edit <name>
         ° delete-profile <name>
+        ° stats-contacts
+        ° dedupe
+        ° merge <name to keep> <name to merge> [phone/birthday/address/email to take from merged]
         ° add-note <name of the note> <text>
         ° add-tags <name of the note> <tags>
         ° find-note <name of the note>
@@ -563,62 +948,66 @@ def main():
         ° edit-note <name of the note> <new text>
         ° find-by-tag <tag>
         ° show-sorted-notes
+        ° begin / commit / rollback
+        ° changes [after number]
+        ° sync <directory>
         ° close/exit""")
-    while True:
-        readline.set_completer(CommandCompleter(
-            Commands.all_values()).complete)
-        readline.set_completer_delims(' ')
-        readline.parse_and_bind('tab: complete')
-        user_input = input("Enter a command: ")
-        command, *args = parse_input(user_input)
+    contacts.events.subscribe(_on_contact_event)
+    journal = ChangeJournal(pickle.path(pickle.CHANGES))
+    contacts.events.subscribe(journal.write)
+    notes.events.subscribe(journal.write)
+    contacts.events.subscribe(replica_state.stamp)
+    notes.events.subscribe(replica_state.stamp)
+    lock = asyncio.Lock()
+    _setup_completion()
+    if "--startup-time" in sys.argv:
+        print(f"Started in {(time.perf_counter() - STARTED_AT) * 1000:.1f} ms")
+    # contacts are read and scheduler heap is built while user types the first command,
+    # only commands which need contacts wait for it
+    warm_up = None
+
+    def attached():
+        return warm_up is not None and warm_up.done()
+
+    background = asyncio.create_task(maintenance(contacts, notes, lock, attached))
+    try:
+        running = True
+        while running:
+            if attached():
+                async with lock:
+                    for reminder in await asyncio.to_thread(scheduler.reminders):
+                        print(reminder)
+            user_input = _read_input("Enter a command: ")
+            if warm_up is None:
+                warm_up = _in_background(_attach, contacts)
+            command, *args = parse_input(await user_input)
+            if command not in NOTES_COMMANDS and command not in (Commands.HELLO, Commands.CLOSE, Commands.EXIT):
+                # returns at once when contacts are already read
+                await warm_up
+            async with lock:
+                await asyncio.to_thread(_sync_stores, contacts, notes, attached())
+                running = await asyncio.to_thread(execute, contacts, notes, command, *args)
+    finally:
+        background.cancel()
+        if warm_up is not None and warm_up.done():
+            # error of reading contacts is shown by the first command which needs them
+            warm_up.exception()
+        if notes.loaded:
+            pickle.collect_blobs(notes)
+        if replica_state.dirty:
+            replica_state.save()
+        pickle.save_contact_stats(contact_stats, contacts)
 
-        if command in [Commands.CLOSE, Commands.EXIT]:
-            print("Good bye!")
-            break
-        elif command == Commands.HELLO:
-            print("How can I help you?")
-        elif command == Commands.ADD:
-            print(add_phone(contacts, *args))
-        elif command == Commands.PHONE:
-            print(get_phone(contacts, *args))
-        elif command == Commands.ALL:
-            print(get_all(contacts))
-        elif command == Commands.FIND:
-            print(find_contact(contacts, *args))
-        elif command == Commands.DELETE:
-            print(delete(contacts, *args))
-        elif command == Commands.ADD_BIRTHDAY:
-            print(add_birthday(contacts, *args))
-        elif command == Commands.SHOW_BIRTHDAY:
-            print(show_birthday(contacts, *args))
-        elif command == Commands.UPCOMING_BIRTHDAY:
-            print(upcoming_birthday(contacts, *args))
-        elif command == Commands.ADD_ADDRESS:
-            print(add_address(contacts, *args))
-        elif command == Commands.SHOW_ADDRESS:
-            print(get_address(contacts, *args))
-        elif command == Commands.ADD_EMAIL:
-            print(add_email(contacts, *args))
-        elif command == Commands.SHOW_EMAIL:
-            print(get_email(contacts, *args))
-        elif command == Commands.ADD_NOTE:
-            print(add_note(notes, *args))
-        elif command == Commands.ADD_TAGS:
-            print(add_tags(notes, *args))
-        elif command == Commands.EDIT_NOTE:
-            print(edit_note(notes, *args))
-        elif command == Commands.FIND_NOTE:
-            print(find_note(notes, *args))
-        elif command == Commands.DELETE_NOTE:
-            print(delete_note(notes, *args))
-        elif command == Commands.FIND_NOTES_BY_TAGS:
-            find_notes_by_tag(notes, *args)
-        elif command == Commands.SORT_NOTES:
-            sort_notes(notes)
-        elif command == Commands.EDIT:
-            print(edit_record(contacts, *args))
-        else:
-            print("Invalid command.")
+
+@input_error
+def main():
+    """ Main method for execution, start point
+    """
+    import asyncio
+    try:
+        asyncio.run(repl())
+    except DataFileError as ex:
+        print(f"{ex}, fix or remove the file and start again")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Query language for contacts with index aware planning, for use it in main.py
+
+    query birthday.month=11 and email.domain=gmail.com sort name limit 20
+"""
+from utils import AddressBook
+from utils import Birthday
+from utils import Record
+from utils import normalize_phone
+
+
+class QueryError(ValueError):
+    pass
+
+
+FIELDS = ("name", "phone", "address", "email", "email.domain",
+          "birthday", "birthday.day", "birthday.month", "birthday.year")
+NUMERIC_FIELDS = ("birthday.day", "birthday.month", "birthday.year")
+OPERATORS = ("!=", ">=", "<=", "=", ">", "<", "~")
+
+
+def field_value(record: Record, path: str):
+    """ Value of field path of record used in predicates and sorting
+    :param record: contact
+    :type record: Record
+    :param path: one of FIELDS
+    :type path: str
+    :return: int for birthday parts, lowercase str for others, None if field is empty
+    """
+    field, _, part = path.partition(".")
+    value = getattr(record, field, None)
+    if value is None:
+        return None
+    if field == "birthday":
+        date_object = value.date_object
+        if date_object is None:
+            return None
+        return getattr(date_object, part) if part else date_object
+    value = str(value.value).lower()
+    if field == "phone":
+        return normalize_phone(value)
+    if part == "domain":
+        return value.rpartition("@")[2] or None
+    return value
+
+
+class Predicate:
+
+    def __init__(self, path: str, operator: str, value):
+        self.path = path
+        self.operator = operator
+        self.value = value
+
+    @classmethod
+    def parse(cls, text: str):
+        """ Parse predicate like email.domain=gmail.com
+        :param text: predicate text
+        :type text: str
+        :rtype: Predicate
+        """
+        for operator in OPERATORS:
+            path, found, value = text.partition(operator)
+            if found:
+                break
+        else:
+            raise QueryError(f"Condition {text} should have one of operators {' '.join(OPERATORS)}")
+        path = path.strip().lower()
+        if path not in FIELDS:
+            raise QueryError(f"Unknown field {path}, use one of {', '.join(FIELDS)}")
+        if path in NUMERIC_FIELDS:
+            try:
+                value = int(value)
+            except ValueError:
+                raise QueryError(f"Value of {path} should be a number") from None
+        elif path == "birthday":
+            value = Birthday.convert_date(value)
+            if value is None:
+                raise QueryError(f"Value of birthday should be in format {Birthday.date_format}")
+        elif path == "phone":
+            value = normalize_phone(value)
+        else:
+            value = value.lower()
+        return cls(path, operator, value)
+
+    def matches(self, record: Record):
+        """ Check predicate on record, empty fields match only !=
+        :rtype: bool
+        """
+        value = field_value(record, self.path)
+        if value is None:
+            return self.operator == "!="
+        if self.operator == "=":
+            return value == self.value
+        if self.operator == "!=":
+            return value != self.value
+        if self.operator == "~":
+            return str(self.value) in str(value)
+        if self.operator == ">":
+            return value > self.value
+        if self.operator == "<":
+            return value < self.value
+        if self.operator == ">=":
+            return value >= self.value
+        return value <= self.value
+
+    def __str__(self):
+        value = self.value.strftime(Birthday.date_format) if self.path == "birthday" else self.value
+        return f"{self.path}{self.operator}{value}"
+
+
+class Query:
+    """ Parsed query: predicates joined by and, optional sort and limit
+    """
+
+    def __init__(self, predicates, sort=None, descending=False, limit=None):
+        self.predicates = predicates
+        self.sort = sort
+        self.descending = descending
+        self.limit = limit
+
+    @classmethod
+    def parse(cls, *args):
+        """ Parse query from cmd arguments
+        :return: parsed query
+        :rtype: Query
+        """
+        words = list(args)
+        predicates, sort, descending, limit = [], None, False, None
+        while words:
+            word = words.pop(0)
+            if word.lower() == "and":
+                continue
+            if word.lower() == "sort":
+                if not words or words[0].lower() not in FIELDS:
+                    raise QueryError(f"Sort should be by one of {', '.join(FIELDS)}")
+                sort = words.pop(0).lower()
+                if words and words[0].lower() in ("asc", "desc"):
+                    descending = words.pop(0).lower() == "desc"
+            elif word.lower() == "limit":
+                if not words or not words[0].isdigit():
+                    raise QueryError("Limit should be a number")
+                limit = int(words.pop(0))
+            else:
+                predicates.append(Predicate.parse(word))
+        return cls(predicates, sort, descending, limit)
+
+
+class ContactIndex:
+    """ Secondary indexes of AddressBook: hash on name and phone,
+    day of year and month of birthday, domain of email.
+    Keeps indexed keys of every record for incremental updates.
+    """
+
+    # predicate path -> index name, only = predicates use indexes
+    INDEXED = {"name": "name", "phone": "phone", "email.domain": "email.domain",
+               "birthday.month": "birthday.month", "birthday": "birthday.day_of_year"}
+
+    def __init__(self, contacts: AddressBook = None):
+        self.contacts = contacts if contacts is not None else AddressBook()
+        self.indexes = {}
+        self._keys = {}
+        self.rebuild()
+
+    def attach(self, contacts: AddressBook):
+        """ Switch index to another address book
+        :param contacts: contacts object
+        """
+        self.contacts = contacts
+        self.rebuild()
+
+    def rebuild(self):
+        """ Build indexes from scratch
+        """
+        self.indexes = {_: {} for _ in self.INDEXED.values()}
+        self._keys = {}
+        with self.contacts.read():
+            for name, record in self.contacts.data.items():
+                self.add(name, record)
+
+    @staticmethod
+    def _index_keys(record: Record):
+        """ Index name -> key of record in that index
+        :rtype: dict
+        """
+        keys = {"name": field_value(record, "name"),
+                "phone": field_value(record, "phone"),
+                "email.domain": field_value(record, "email.domain"),
+                "birthday.month": field_value(record, "birthday.month")}
+        birthday = field_value(record, "birthday")
+        keys["birthday.day_of_year"] = (birthday.month, birthday.day) if birthday else None
+        return {index: key for index, key in keys.items() if key is not None}
+
+    def add(self, name: str, record: Record):
+        """ Index record, replaces old index keys of the same name
+        :param name: key of record in address book
+        :type name: str
+        :param record: contact
+        :type record: Record
+        """
+        self.remove(name)
+        keys = self._index_keys(record)
+        for index, key in keys.items():
+            self.indexes[index].setdefault(key, set()).add(name)
+        self._keys[name] = keys
+
+    def remove(self, name: str):
+        """ Remove record from indexes
+        :param name: key of record in address book
+        :type name: str
+        """
+        for index, key in self._keys.pop(name, {}).items():
+            names = self.indexes[index].get(key)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.indexes[index][key]
+
+    def lookup(self, predicate: Predicate):
+        """ Names matched by = predicate from index
+        :return: set of names or None if predicate can not use index
+        :rtype: set or None
+        """
+        if predicate.operator != "=" or predicate.path not in self.INDEXED:
+            return None
+        key = predicate.value
+        if predicate.path == "birthday":
+            key = (key.month, key.day)
+        return self.indexes[self.INDEXED[predicate.path]].get(key, set())
+
+    def plan(self, query: Query):
+        """ Choose indexes for query
+        :return: candidate names or None for full scan, predicates to check, plan steps
+        :rtype: tuple
+        """
+        looked_up = []
+        for predicate in query.predicates:
+            names = self.lookup(predicate)
+            if names is not None:
+                looked_up.append((len(names), str(predicate), names))
+        if not looked_up:
+            return None, query.predicates, [f"full scan of {len(self.contacts.data)} contacts"]
+        looked_up.sort(key=lambda item: item[0])
+        candidates = set(looked_up[0][2])
+        steps = [f"index {looked_up[0][1]} ({looked_up[0][0]} contacts)"]
+        for size, predicate, names in looked_up[1:]:
+            candidates &= names
+            steps.append(f"intersect index {predicate} ({size} contacts) -> {len(candidates)}")
+        return candidates, query.predicates, steps
+
+    def execute(self, query: Query):
+        """ Run query, records are ordered by name unless query sorts them by other field
+        :return: matched records and plan steps
+        :rtype: tuple
+        """
+        with self.contacts.read():
+            candidates, predicates, steps = self.plan(query)
+            data = self.contacts.data
+            records = data.values() if candidates is None else [data[_] for _ in candidates if _ in data]
+            result = [_ for _ in records if all(predicate.matches(_) for predicate in predicates)]
+        # candidates of index are a set, so records are ordered by name for the same output of both plans
+        result.sort(key=lambda record: record.name.value)
+        steps.append(f"filter {' and '.join(str(_) for _ in predicates) or 'nothing'} -> {len(result)}")
+        if query.sort:
+            present = [_ for _ in result if field_value(_, query.sort) is not None]
+            absent = [_ for _ in result if field_value(_, query.sort) is None]
+            present.sort(key=lambda record: field_value(record, query.sort), reverse=query.descending)
+            result = present + absent
+            steps.append(f"sort by {query.sort}{' desc' if query.descending else ''}")
+        if query.limit is not None:
+            result = result[:query.limit]
+            steps.append(f"limit {query.limit}")
+        return result, steps
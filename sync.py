@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Offline replication of contacts and notes between two directories, for use it in main.py
+or from command line:
+
+    python sync.py <directory> <other directory>
+
+Every record has version stamped by hybrid logical clock, deleted records leave
+tombstones, so deletes are replicated too. Replicas compare Merkle trees of versions
+first and exchange only records of different leaves, the newest version wins.
+"""
+import os
+import sys
+import copy
+import time
+from utils import AddressBook
+from utils import Notes
+from utils import Codec
+from utils import Event
+from utils import Pickle
+
+
+def _hash(items):
+    """ Short hash of list of strings
+    :rtype: str
+    """
+    import hashlib
+    return hashlib.blake2b("\n".join(items).encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class HybridClock:
+    """ Hybrid logical clock: wall time in milliseconds, counter for stamps made in
+    the same millisecond or after stamp from clock which is ahead, and node id.
+    Stamps are strings which sort in order of clock, node id makes them unique.
+    """
+
+    def __init__(self, node: str, wall: int = 0, counter: int = 0):
+        self.node = node
+        self.wall = wall
+        self.counter = counter
+
+    @staticmethod
+    def parse(stamp: str):
+        """ Parts of stamp
+        :return: wall, counter, node
+        :rtype: tuple
+        """
+        wall, counter, node = stamp.split("-", 2)
+        return int(wall), int(counter), node
+
+    def stamp(self):
+        """ Current stamp of clock
+        :rtype: str
+        """
+        return f"{self.wall:015d}-{self.counter:06d}-{self.node}"
+
+    def tick(self):
+        """ Stamp for new local change, always bigger than all seen stamps
+        :rtype: str
+        """
+        now = int(time.time() * 1000)
+        if now > self.wall:
+            self.wall, self.counter = now, 0
+        else:
+            self.counter += 1
+        return self.stamp()
+
+    def observe(self, stamp: str):
+        """ Move clock forward to stamp received from other replica
+        :param stamp: stamp of other clock
+        :type stamp: str
+        """
+        wall, counter, _ = self.parse(stamp)
+        if (wall, counter) > (self.wall, self.counter):
+            self.wall, self.counter = wall, counter
+
+
+class ReplicaState:
+    """ Versions of records of one directory, kept in replica.json and read on
+    first access: {store: {key: [stamp, digest]}}. Digest is TOMBSTONE for deleted
+    record and None for record changed after digest was taken.
+    """
+
+    FILE = "replica.json"
+    STORES = (AddressBook.STORE, Notes.STORE)
+    TOMBSTONE = ""
+
+    def __init__(self, pickle: Pickle):
+        self.pickle = pickle
+        self.file_name = pickle.path(self.FILE)
+        # changes made by replication keep stamps of other replica
+        self.applying = False
+        self.dirty = False
+        self._clock = None
+        self._versions = None
+
+    def _load(self):
+        if self._versions is not None:
+            return
+        import json
+        with self.pickle.locked(self.file_name, exclusive=False):
+            try:
+                with open(self.file_name, "r", encoding="utf-8") as _file:
+                    content = json.load(_file)
+            except FileNotFoundError:
+                import uuid
+                content = {"node": uuid.uuid4().hex[:12], "clock": [0, 0], "versions": {}}
+        self._clock = HybridClock(content["node"], *content["clock"])
+        self._versions = {_: content["versions"].get(_, {}) for _ in self.STORES}
+
+    @property
+    def clock(self):
+        """ Clock of replica
+        :rtype: HybridClock
+        """
+        self._load()
+        return self._clock
+
+    @property
+    def versions(self):
+        """ Versions of records by store
+        :rtype: dict
+        """
+        self._load()
+        return self._versions
+
+    def stamp(self, event: Event):
+        """ Subscriber of store events, gives new stamp to changed record.
+        Changes merged from other processes keep stamps given by them
+        :param event: change of record
+        :type event: Event
+        """
+        if self.applying or event.origin == Event.MERGE:
+            return
+        digest = self.TOMBSTONE if event.new is None else None
+        self.versions[event.store][event.key] = [self.clock.tick(), digest]
+        self.dirty = True
+
+    def refresh(self, data):
+        """ Take digests of changed records and stamp changes which were made
+        without events: by other tools, old versions of bot or before replica.json
+        :param data: AddressBook or Notes
+        """
+        kind = Codec.kind_of(data)
+        versions = self.versions[data.STORE]
+        with data.read():
+            for key, value in data.data.items():
+                digest = Codec.digest(kind, key, value).hex()
+                version = versions.get(key)
+                if version is None or version[1] not in (None, digest):
+                    versions[key] = [self.clock.tick(), digest]
+                    self.dirty = True
+                elif version[1] is None:
+                    version[1] = digest
+                    self.dirty = True
+            for key, version in versions.items():
+                if key not in data.data and version[1] != self.TOMBSTONE:
+                    versions[key] = [self.clock.tick(), self.TOMBSTONE]
+                    self.dirty = True
+
+    def _take_newer(self):
+        """ Take versions saved by other processes of the same directory
+        which are newer than ours, file must be locked
+        """
+        import json
+        try:
+            with open(self.file_name, "r", encoding="utf-8") as _file:
+                disk = json.load(_file)
+        except FileNotFoundError:
+            return
+        for store, versions in disk["versions"].items():
+            for key, version in versions.items():
+                current = self._versions.setdefault(store, {}).get(key)
+                if current is None or version[0] > current[0]:
+                    self._versions[store][key] = version
+                    self._clock.observe(version[0])
+
+    def merge(self):
+        """ Take newer versions saved by other processes of the same directory,
+        records merged from them keep their stamps
+        """
+        if self._versions is None:
+            return
+        with self.pickle.locked(self.file_name, exclusive=False):
+            self._take_newer()
+
+    def save(self):
+        """ Save versions under exclusive lock, newer versions saved by other
+        processes of the same directory are kept
+        """
+        if self._versions is None:
+            return
+        import json
+        with self.pickle.locked(self.file_name):
+            self._take_newer()
+            tmp_name = f"{self.file_name}.{os.getpid()}.tmp"
+            with open(tmp_name, "w", encoding="utf-8") as _file:
+                json.dump({"node": self._clock.node, "clock": [self._clock.wall, self._clock.counter],
+                           "versions": self._versions}, _file, ensure_ascii=False)
+            os.replace(tmp_name, self.file_name)
+        self.dirty = False
+
+
+class MerkleTree:
+    """ Two level hash tree of versions: FANOUT nodes of FANOUT leaves, key goes
+    to leaf by its hash. Equal replicas are confirmed by one root comparison,
+    different leaves are found in at most 1 + FANOUT * (FANOUT + 1) comparisons
+    """
+
+    FANOUT = 16
+
+    def __init__(self, versions: dict):
+        buckets = [[] for _ in range(self.FANOUT ** 2)]
+        for key, (stamp, digest) in versions.items():
+            buckets[self.leaf_of(key)].append(f"{key}\x00{stamp}\x00{digest}")
+        self.leaves = [_hash(sorted(_)) for _ in buckets]
+        self.nodes = [_hash(self.leaves[_ * self.FANOUT:(_ + 1) * self.FANOUT]) for _ in range(self.FANOUT)]
+        self.root = _hash(self.nodes)
+
+    @classmethod
+    def leaf_of(cls, key: str):
+        """ Index of leaf of key
+        :rtype: int
+        """
+        import hashlib
+        digest = hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=2).digest()
+        return int.from_bytes(digest, "big") % cls.FANOUT ** 2
+
+    def diff(self, other):
+        """ Leaves which differ from leaves of other tree
+        :param other: tree of other replica
+        :type other: MerkleTree
+        :return: set of leaf indexes, count of hash comparisons
+        :rtype: tuple
+        """
+        comparisons = 1
+        if self.root == other.root:
+            return set(), comparisons
+        leaves = set()
+        for node in range(self.FANOUT):
+            comparisons += 1
+            if self.nodes[node] == other.nodes[node]:
+                continue
+            for leaf in range(node * self.FANOUT, (node + 1) * self.FANOUT):
+                comparisons += 1
+                if self.leaves[leaf] != other.leaves[leaf]:
+                    leaves.add(leaf)
+        return leaves, comparisons
+
+
+class Replica:
+    """ Contacts and notes of one directory with versions of their records
+    """
+
+    def __init__(self, pickle: Pickle, contacts: AddressBook, notes: Notes, state: ReplicaState):
+        self.pickle = pickle
+        self.state = state
+        self.stores = {AddressBook.STORE: contacts, Notes.STORE: notes}
+
+    @classmethod
+    def open(cls, directory: str):
+        """ Replica of directory, stores are read on first access
+        :param directory: directory with contacts and notes files
+        :type directory: str
+        :rtype: Replica
+        """
+        pickle = Pickle(directory)
+        return cls(pickle, pickle.read_contacts(), pickle.read_notes(), ReplicaState(pickle))
+
+    def refresh(self):
+        """ Merge in records and versions saved by other processes of the same
+        directory, then stamp changes which were made without events
+        """
+        self.pickle.refresh_contacts(self.stores[AddressBook.STORE])
+        self.pickle.refresh_notes(self.stores[Notes.STORE])
+        self.state.merge()
+        for data in self.stores.values():
+            self.state.refresh(data)
+
+    def transaction(self, store: str):
+        """ Transaction on store with one save on commit
+        """
+        if store == AddressBook.STORE:
+            return self.pickle.contacts_transaction(self.stores[store])
+        return self.pickle.notes_transaction(self.stores[store])
+
+    def apply(self, store: str, key: str, source, version: list):
+        """ Copy record or its deletion from source replica
+        :param store: name of store
+        :type store: str
+        :param key: key of record
+        :type key: str
+        :param source: replica with the newest version of record
+        :type source: Replica
+        :param version: version of record in source replica
+        :type version: list
+        """
+        data = self.stores[store]
+        self.state.applying = True
+        try:
+            if version[1] == self.state.TOMBSTONE:
+                if key in data.data:
+                    del data[key]
+            else:
+                value = copy.deepcopy(source.stores[store].data[key])
+                if store == Notes.STORE and "blob" in value:
+                    data.blobs.put(source.stores[store].text(key))
+                data[key] = value
+        finally:
+            self.state.applying = False
+        self.state.versions[store][key] = list(version)
+        self.state.clock.observe(version[0])
+        self.state.dirty = True
+
+
+def synchronize(local: Replica, remote: Replica):
+    """ Exchange changed records between two replicas, both get the newest version of
+    every record. Versions are compared as (stamp, digest), so the same record wins
+    on both sides whatever replica starts synchronization.
+    :param local: replica
+    :type local: Replica
+    :param remote: other replica
+    :type remote: Replica
+    :return: {store: (sent, received)}, count of hash comparisons
+    :rtype: tuple
+    """
+    report, comparisons = {}, 0
+    for replica in (local, remote):
+        replica.refresh()
+    for store in ReplicaState.STORES:
+        ours, theirs = local.state.versions[store], remote.state.versions[store]
+        leaves, count = MerkleTree(ours).diff(MerkleTree(theirs))
+        comparisons += count
+        sent = received = 0
+        if leaves:
+            keys = sorted(_ for _ in set(ours) | set(theirs) if MerkleTree.leaf_of(_) in leaves)
+            with local.transaction(store), remote.transaction(store):
+                for key in keys:
+                    mine, other = ours.get(key), theirs.get(key)
+                    if mine == other:
+                        continue
+                    if other is None or (mine is not None and mine > other):
+                        remote.apply(store, key, local, mine)
+                        sent += 1
+                    else:
+                        local.apply(store, key, remote, other)
+                        received += 1
+        report[store] = (sent, received)
+    local.state.save()
+    remote.state.save()
+    return report, comparisons
+
+
+def main():
+    """ Synchronize two directories from command line
+    """
+    if len(sys.argv) != 3:
+        print("Usage: python sync.py <directory> <other directory>")
+        return
+    report, comparisons = synchronize(Replica.open(sys.argv[1]), Replica.open(sys.argv[2]))
+    for store, (sent, received) in report.items():
+        print(f"{store}: {sent} sent, {received} received")
+    print(f"{comparisons} hash comparisons")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Modules of bot are flat, so tests import them from the project directory
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of heap based birthday scheduler: leap days, ranges across new year
+and moving of the heap when days pass
+"""
+from datetime import date
+from utils import AddressBook
+from utils import BirthdayScheduler
+from utils import Record
+
+
+def _scheduler(today, **birthdays):
+    contacts = AddressBook()
+    for name, birthday in birthdays.items():
+        record = Record(name)
+        record.add_birthday(birthday)
+        contacts[name] = record
+    return BirthdayScheduler(contacts, today)
+
+
+def test_leap_day_birthday_in_not_leap_year():
+    birthday = date(1992, 2, 29)
+    day = BirthdayScheduler.anniversary(birthday, 2027)
+    assert day == date(2027, 2, 28)
+    assert BirthdayScheduler.congratulation_date(day) == date(2027, 3, 1)
+    assert BirthdayScheduler.congratulation_date(day).strftime("%a") == "Mon"
+    assert BirthdayScheduler.anniversary(birthday, 2028) == date(2028, 2, 29)
+    scheduler = _scheduler(date(2027, 1, 10), Ann="29.02.1992")
+    assert scheduler.between(date(2027, 2, 1), date(2027, 3, 31), date(2027, 1, 10)) == [(date(2027, 2, 28), "Ann")]
+
+
+def test_range_across_new_year():
+    scheduler = _scheduler(date(2026, 12, 20), Ann="25.12.1990", Bob="05.01.1985", Eve="15.06.2000")
+    assert scheduler.between(date(2026, 12, 20), date(2027, 1, 10), date(2026, 12, 20)) == [
+        (date(2026, 12, 25), "Ann"), (date(2027, 1, 5), "Bob")]
+    assert scheduler.reminders(days_before=20, today=date(2026, 12, 20)) == [
+        "Reminder: Ann has birthday on 25.12.2026", "Reminder: Bob has birthday on 05.01.2027"]
+
+
+def test_advance_moves_past_birthdays_to_next_year():
+    scheduler = _scheduler(date(2026, 3, 1), Ann="02.03.1990", Bob="10.03.1990")
+    assert scheduler.reminders(days_before=1, today=date(2026, 3, 1)) == ["Reminder: Ann has birthday on 02.03.2026"]
+    assert scheduler.reminders(days_before=1, today=date(2026, 3, 1)) == []
+    scheduler.advance(date(2026, 3, 3))
+    assert sorted(scheduler._heap)[0][:2] == (date(2026, 3, 10), "Bob")
+    assert scheduler.between(date(2026, 3, 3), date(2027, 3, 31), date(2026, 3, 3)) == [
+        (date(2026, 3, 10), "Bob"), (date(2027, 3, 2), "Ann"), (date(2027, 3, 10), "Bob")]
+    assert scheduler.reminders(today=date(2026, 3, 10)) == ["Reminder: Bob has birthday today"]
+
+
+def test_changed_and_deleted_contacts_are_not_returned():
+    scheduler = _scheduler(date(2026, 1, 1), Ann="02.03.1990", Bob="10.03.1990")
+    scheduler.contacts.events.subscribe(
+        lambda event: scheduler.schedule(event.new) if event.new else scheduler.unschedule(event.key))
+    with scheduler.contacts.edit("Ann") as record:
+        record.add_birthday("05.04.1990")
+    del scheduler.contacts["Bob"]
+    assert scheduler.between(date(2026, 1, 1), date(2026, 12, 31), date(2026, 1, 1)) == [(date(2026, 4, 5), "Ann")]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of binary format of data files, migration of old files and rejection of
+damaged and unsafe ones
+"""
+import os
+import pickle
+import struct
+import pytest
+from utils import AddressBook
+from utils import Codec
+from utils import DataFileError
+from utils import Notes
+from utils import Pickle
+from utils import Record
+
+
+def _contacts():
+    contacts = AddressBook()
+    full = Record("Анна")
+    full.add_phone("0501112233")
+    full.add_birthday("29.02.1992")
+    full.add_address("Київ, вул. Хрещатик 1")
+    full.add_email("anna@example.com")
+    contacts["Анна"] = full
+    contacts["Bob"] = Record("Bob")
+    contacts.generation = 7
+    return contacts
+
+
+def _encode(version, kind, columns, rows):
+    """ File in format of given version, written by hand like old bot did
+    """
+    values = [_ for row in rows for _ in row]
+    return b"".join([
+        Codec.HEADER.pack(Codec.MAGIC, version, kind, 1, len(rows), len(columns)),
+        b"".join(bytes([len(_)]) + _.encode("ascii") for _ in columns),
+        struct.pack(f"<{len(values)}i", *[-1 if _ is None else len(_) for _ in values]),
+        "".join(_ for _ in values if _ is not None).encode("utf-8"),
+    ])
+
+
+def test_contacts_round_trip():
+    contacts = _contacts()
+    loaded = Codec.loads(Codec.dumps(contacts))
+    assert isinstance(loaded, AddressBook)
+    assert loaded.generation == 7
+    assert list(loaded.data) == list(contacts.data)
+    for name, record in contacts.data.items():
+        assert Codec.row(Codec.CONTACTS, name, loaded.data[name]) == Codec.row(Codec.CONTACTS, name, record)
+    assert loaded.data["Анна"].birthday.date_object.day == 29
+    assert loaded.data["Bob"].phone is None
+
+
+def test_notes_round_trip():
+    notes = Notes()
+    notes.data["todo"] = {"blob": "0" * 32, "tags": ["home", "shop"]}
+    notes.data["empty"] = {"blob": "1" * 32, "tags": []}
+    loaded = Codec.loads(Codec.dumps(notes))
+    assert isinstance(loaded, Notes)
+    assert loaded.data == notes.data
+
+
+def test_notes_of_version_1_keep_text(tmp_path):
+    content = _encode(1, Codec.NOTES, ["name", "text", "tags"],
+                      [["todo", "buy milk", "home" + Codec.SEPARATOR + "shop"], ["idea", "", None]])
+    loaded = Codec.loads(content)
+    assert loaded.data == {"todo": {"text": "buy milk", "tags": ["home", "shop"]},
+                           "idea": {"text": "", "tags": []}}
+    (tmp_path / Pickle.NOTES).write_bytes(content)
+    notes = Pickle(str(tmp_path)).read_notes()
+    assert notes.text("todo") == "buy milk"
+    assert "blob" in notes.data["todo"]
+
+
+def test_unknown_columns_are_skipped():
+    content = _encode(Codec.VERSION, Codec.CONTACTS, ["name", "color", "phone"], [["Ann", "red", "0501112233"]])
+    record = Codec.loads(content).data["Ann"]
+    assert record.phone.value == "0501112233"
+    assert record.email is None
+
+
+def test_legacy_pickle_is_migrated(tmp_path):
+    with open(tmp_path / Pickle.LEGACY[Pickle.CONTACTS], "wb") as _file:
+        pickle.dump(_contacts(), _file)
+    storage = Pickle(str(tmp_path))
+    contacts = storage.read_contacts()
+    assert contacts["Анна"].email.value == "anna@example.com"
+    storage.save_contacts(contacts)
+    assert Codec.loads((tmp_path / Pickle.CONTACTS).read_bytes()).data["Анна"].phone.value == "0501112233"
+
+
+class _Exploit:
+    def __reduce__(self):
+        return os.system, ("echo exploited > exploited.txt",)
+
+
+def test_legacy_pickle_with_not_allowed_class_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open(Pickle.LEGACY[Pickle.CONTACTS], "wb") as _file:
+        pickle.dump({"Ann": _Exploit()}, _file)
+    with pytest.raises(DataFileError, match="not allowed"):
+        Pickle().read_contacts().load()
+    assert not os.path.exists("exploited.txt")
+
+
+@pytest.mark.parametrize("size", [2, 10, Codec.HEADER.size + 3, -1])
+def test_truncated_file_is_rejected(size):
+    content = Codec.dumps(_contacts())
+    with pytest.raises(DataFileError):
+        Codec.loads(content[:size])
+
+
+def test_damaged_file_name_is_reported(tmp_path):
+    (tmp_path / Pickle.CONTACTS).write_bytes(Codec.dumps(_contacts())[:-5])
+    with pytest.raises(DataFileError, match=Pickle.CONTACTS):
+        Pickle(str(tmp_path)).read_contacts().load()
+
+
+@pytest.mark.parametrize("columns, rows", [
+    ([], []),
+    (["name", "phone"], [[None, "0501112233"]]),
+    (["phone"], [["0501112233"]]),
+])
+def test_file_with_wrong_values_is_rejected(columns, rows):
+    with pytest.raises(DataFileError, match="damaged"):
+        Codec.loads(_encode(Codec.VERSION, Codec.CONTACTS, columns, rows))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Stress tests of AddressBook and Notes under thread pool: readers must always
+see consistent records and nothing may deadlock.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from utils import AddressBook
+from utils import Notes
+from utils import Record
+
+WORKERS = 16
+OPERATIONS = 10000
+RECORDS = 50
+# seconds to wait for one operation, longer wait means deadlock
+TIMEOUT = 60
+
+
+def _record(name, number):
+    record = Record(name)
+    record.add_phone(f"050{number:07d}")
+    record.add_email(f"{number}@example.com")
+    return record
+
+
+def _number(record):
+    """ Number of record, phone and email must always have the same one
+    """
+    from_phone = int(record.phone.value[3:])
+    from_email = int(record.email.value.partition("@")[0])
+    assert from_phone == from_email, f"half done edit of {record.name.value}"
+    return from_phone
+
+
+def _run(operation):
+    with ThreadPoolExecutor(WORKERS) as executor:
+        futures = [executor.submit(operation, _) for _ in range(OPERATIONS)]
+        for future in futures:
+            future.result(timeout=TIMEOUT)
+
+
+def test_contacts_readers_see_whole_edits():
+    contacts = AddressBook()
+    for i in range(RECORDS):
+        contacts[f"name{i}"] = _record(f"name{i}", 0)
+
+    def operation(i):
+        name = f"name{random.randrange(RECORDS)}"
+        kind = i % 4
+        if kind == 0:
+            number = random.randrange(10 ** 6)
+            with contacts.edit(name) as record:
+                record.add_phone(f"050{number:07d}")
+                record.add_email(f"{number}@example.com")
+        elif kind == 1:
+            with contacts.read():
+                for record in contacts.data.values():
+                    _number(record)
+        elif kind == 2:
+            _number(contacts.snapshot(name))
+        else:
+            assert len(contacts) == RECORDS
+            assert sorted(contacts) == sorted(contacts.data)
+
+    _run(operation)
+    assert len(contacts) == RECORDS
+    for record in contacts.values():
+        _number(record)
+
+
+def test_contacts_inserts_and_deletes():
+    contacts = AddressBook()
+
+    def operation(i):
+        name = f"name{i % RECORDS}"
+        kind = i % 3
+        if kind == 0:
+            contacts[name] = _record(name, i)
+        elif kind == 1:
+            contacts.pop(name, None)
+        else:
+            with contacts.read():
+                for key, record in contacts.data.items():
+                    assert record.name.value == key
+                    _number(record)
+
+    _run(operation)
+    assert all(record.name.value == key for key, record in contacts.data.items())
+
+
+def test_notes_tags_are_not_lost():
+    notes = Notes()
+    for i in range(RECORDS):
+        notes.add_note(f"note{i}", f"text {i}")
+
+    def operation(i):
+        name = f"note{i % RECORDS}"
+        kind = i % 4
+        if kind == 0:
+            notes.add_tags(name, f"tag{i}")
+        elif kind == 1:
+            assert notes.find_note(name).startswith(f"Note`s name: {name}")
+        elif kind == 2:
+            for found in notes.find_notes_by_tag(f"tag{i - 2}").values():
+                assert f"tag{i - 2}" in found["tags"]
+        else:
+            assert len(notes.sort_notes()) == RECORDS
+
+    _run(operation)
+    tags = [tag for note in notes.data.values() for tag in note["tags"]]
+    assert len(tags) == len(set(tags)) == len(range(0, OPERATIONS, 4))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of change events and of journal shared by processes of one directory
+"""
+import json
+from utils import AddressBook
+from utils import ChangeJournal
+from utils import Event
+from utils import Pickle
+from utils import Record
+
+
+def _record(name, phone):
+    record = Record(name)
+    record.add_phone(phone)
+    return record
+
+
+def _lines(file_name):
+    with open(file_name, encoding="utf-8") as _file:
+        return [json.loads(_) for _ in _file]
+
+
+def test_old_value_is_copy():
+    contacts = AddressBook()
+    events = []
+    contacts.events.subscribe(events.append)
+    record = _record("Ann", "0501112233")
+    contacts["Ann"] = record
+    contacts["Ann"] = _record("Ann", "0672223344")
+    record.add_phone("0000000000")
+    assert events[-1].old.phone.value == "0501112233"
+
+
+def test_merged_changes_are_not_journaled_again(tmp_path):
+    first, second = Pickle(str(tmp_path)), Pickle(str(tmp_path))
+    ours, theirs = first.read_contacts(), second.read_contacts()
+    theirs.load()
+    for storage, contacts in ((first, ours), (second, theirs)):
+        journal = ChangeJournal(storage.path(storage.CHANGES))
+        contacts.events.subscribe(journal.write)
+    events = []
+    theirs.events.subscribe(events.append)
+    ours["Ann"] = _record("Ann", "0501112233")
+    first.save_contacts(ours)
+    second.refresh_contacts(theirs)
+    theirs["Bob"] = _record("Bob", "0672223344")
+    second.save_contacts(theirs)
+    assert [(_.key, _.origin) for _ in events] == [("Ann", Event.MERGE), ("Bob", Event.LOCAL)]
+    lines = _lines(first.path(first.CHANGES))
+    assert [(_["key"], _["seq"]) for _ in lines] == [("Ann", 1), ("Bob", 2)]
+
+
+def test_journal_is_rotated(tmp_path, monkeypatch):
+    monkeypatch.setattr(ChangeJournal, "MAX_BYTES", 1000)
+    file_name = str(tmp_path / Pickle.CHANGES)
+    contacts = AddressBook()
+    contacts.events.subscribe(ChangeJournal(file_name).write)
+    for i in range(50):
+        contacts[f"name{i}"] = _record(f"name{i}", f"050{i:07d}")
+    backups = [_lines(f"{file_name}.{_}") for _ in range(ChangeJournal.BACKUP_COUNT, 0, -1)]
+    seqs = [_["seq"] for lines in backups + [_lines(file_name)] for _ in lines]
+    assert seqs == list(range(seqs[0], 51))
+    assert not (tmp_path / f"{Pickle.CHANGES}.{ChangeJournal.BACKUP_COUNT + 1}").exists()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of query planning: plans with and without indexes give the same ordered result
+"""
+from utils import AddressBook
+from utils import Record
+from query import ContactIndex
+from query import Query
+
+NAMES = ["Olga", "bob", "Anna", "Zoe", "Ivan", "anna2", "Petro", "Mark"]
+
+
+def _index():
+    contacts = AddressBook()
+    for i, name in enumerate(NAMES):
+        record = Record(name)
+        record.add_phone(f"050{i:07d}")
+        record.add_email(f"{name.lower()}@{'gmail.com' if i % 2 else 'ukr.net'}")
+        record.add_birthday(f"0{i % 3 + 1}.0{i % 2 + 1}.1990")
+        contacts[name] = record
+    return ContactIndex(contacts)
+
+
+def _names(index, *args):
+    records, steps = index.execute(Query.parse(*args))
+    return [_.name.value for _ in records], steps
+
+
+def test_index_and_scan_give_the_same_order():
+    index = _index()
+    indexed, steps = _names(index, "email.domain=gmail.com")
+    assert steps[0].startswith("index")
+    scanned, steps = _names(index, "email~gmail.com")
+    assert not steps[0].startswith("index")
+    assert indexed == scanned == sorted(NAMES[1::2])
+
+
+def test_equal_sort_values_are_ordered_by_name():
+    index = _index()
+    names, _ = _names(index, "sort", "birthday.month", "desc", "limit", "5")
+    assert names == sorted(NAMES[1::2]) + sorted(NAMES[::2])[:1]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of storage shared by processes of one directory: Pickle instances on
+one directory stand for processes, the last test runs real ones
+"""
+import os
+import time
+import multiprocessing
+import pytest
+from utils import BlobStore
+from utils import Pickle
+from utils import Record
+
+HOUR_AGO = time.time() - 2 * 3600
+PROCESSES = 4
+PROCESS_RECORDS = 25
+# seconds to wait for one process, longer wait means deadlock
+TIMEOUT = 60
+
+
+def _age(path):
+    os.utime(path, (HOUR_AGO, HOUR_AGO))
+
+
+def _blob_path(storage, text):
+    key = BlobStore.key(text)
+    return os.path.join(storage.path(Pickle.NOTES_BLOBS), key[:2], key[2:])
+
+
+def _notes(storage):
+    notes = storage.read_notes()
+    notes.load()
+    return notes
+
+
+def _contacts(storage):
+    contacts = storage.read_contacts()
+    contacts.load()
+    return contacts
+
+
+def _add(storage, contacts, name, phone="0501112233"):
+    record = Record(name)
+    record.add_phone(phone)
+    contacts[name] = record
+    storage.save_contacts(contacts)
+
+
+def _names(directory):
+    return sorted(Pickle(directory).read_contacts())
+
+
+def test_put_of_saved_text_renews_it(tmp_path):
+    blobs = BlobStore(str(tmp_path))
+    key = blobs.put("buy milk")
+    path = os.path.join(str(tmp_path), key[:2], key[2:])
+    _age(path)
+    assert blobs.put("buy milk") == key
+    assert blobs.collect(set()) == 0
+    _age(path)
+    assert blobs.collect(set()) == 1
+
+
+def test_text_added_again_by_other_process_is_kept(tmp_path):
+    first, second = Pickle(str(tmp_path)), Pickle(str(tmp_path))
+    ours, theirs = _notes(first), _notes(second)
+    ours.add_note("todo", "buy milk")
+    first.save_notes(ours)
+    _age(_blob_path(first, "buy milk"))
+    ours.delete_note("todo")
+    first.save_notes(ours)
+    theirs.add_note("shop", "buy milk")
+    first.collect_blobs(ours)
+    second.save_notes(theirs)
+    assert Pickle(str(tmp_path)).read_notes().text("shop") == "buy milk"
+
+
+def test_texts_saved_by_other_process_are_kept(tmp_path):
+    first, second = Pickle(str(tmp_path)), Pickle(str(tmp_path))
+    ours, theirs = _notes(first), _notes(second)
+    theirs.add_note("shop", "buy milk")
+    second.save_notes(theirs)
+    _age(_blob_path(second, "buy milk"))
+    assert first.collect_blobs(ours) == 0
+    assert "shop" in ours
+    assert Pickle(str(tmp_path)).read_notes().text("shop") == "buy milk"
+
+
+def test_changes_of_different_keys_are_merged_on_save(tmp_path):
+    first, second = Pickle(str(tmp_path)), Pickle(str(tmp_path))
+    ours, theirs = _contacts(first), _contacts(second)
+    _add(first, ours, "Ann")
+    _add(second, theirs, "Bob")
+    assert sorted(theirs) == ["Ann", "Bob"]
+    _add(first, ours, "Eve")
+    assert sorted(ours) == _names(str(tmp_path)) == ["Ann", "Bob", "Eve"]
+
+
+def test_refresh_merges_changes_of_other_process(tmp_path):
+    first, second = Pickle(str(tmp_path)), Pickle(str(tmp_path))
+    ours, theirs = _contacts(first), _contacts(second)
+    _add(first, ours, "Ann")
+    _add(first, ours, "Bob")
+    assert second.refresh_contacts(theirs) == 2
+    assert second.refresh_contacts(theirs) == 0
+    ours.pop("Ann")
+    first.save_contacts(ours)
+    assert second.refresh_contacts(theirs) == 1
+    assert sorted(theirs) == ["Bob"]
+
+
+def test_local_change_of_the_same_key_wins(tmp_path):
+    first, second = Pickle(str(tmp_path)), Pickle(str(tmp_path))
+    ours, theirs = _contacts(first), _contacts(second)
+    _add(first, ours, "Ann")
+    second.refresh_contacts(theirs)
+    _add(first, ours, "Ann", "0500000001")
+    with theirs.edit("Ann") as record:
+        record.edit_phone("0500000002")
+    second.save_contacts(theirs)
+    assert theirs["Ann"].phone.value == "0500000002"
+    assert Pickle(str(tmp_path)).read_contacts()["Ann"].phone.value == "0500000002"
+
+
+def _add_many(directory, prefix):
+    storage = Pickle(directory)
+    contacts = _contacts(storage)
+    for i in range(PROCESS_RECORDS):
+        _add(storage, contacts, f"{prefix}{i}")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="processes are forked")
+def test_saves_of_processes_do_not_lose_records(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_add_many, args=(str(tmp_path), f"p{_}-")) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(TIMEOUT)
+        assert process.exitcode == 0
+    assert len(_names(str(tmp_path))) == PROCESSES * PROCESS_RECORDS
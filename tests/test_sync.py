@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of replication between two local directories
+"""
+import time
+import pytest
+from utils import Pickle
+from utils import Record
+from sync import HybridClock
+from sync import MerkleTree
+from sync import Replica
+from sync import ReplicaState
+from sync import synchronize
+
+
+def _edit(directory, change):
+    """ Change stores of directory like bot does: events stamp changed records
+    """
+    storage = Pickle(str(directory))
+    contacts, notes, state = storage.read_contacts(), storage.read_notes(), ReplicaState(storage)
+    contacts.events.subscribe(state.stamp)
+    notes.events.subscribe(state.stamp)
+    change(contacts, notes)
+    storage.save_contacts(contacts)
+    storage.save_notes(notes)
+    state.save()
+
+
+def _add(name, phone):
+    def change(contacts, notes):
+        record = Record(name)
+        record.add_phone(phone)
+        contacts[name] = record
+    return change
+
+
+def _change_phone(name, phone):
+    def change(contacts, notes):
+        with contacts.edit(name) as record:
+            record.edit_phone(phone)
+    return change
+
+
+def _phones(directory):
+    contacts = Pickle(str(directory)).read_contacts()
+    return {name: record.phone.value for name, record in contacts.items()}
+
+
+def _sync(first, second):
+    return synchronize(Replica.open(str(first)), Replica.open(str(second)))
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    _edit(first, _add("Ann", "0501112233"))
+    _edit(first, lambda contacts, notes: notes.add_note("todo", "buy milk"))
+    _sync(first, second)
+    return first, second
+
+
+def test_added_records_are_copied(replicas):
+    first, second = replicas
+    assert _phones(second) == {"Ann": "0501112233"}
+    assert Pickle(str(second)).read_notes().text("todo") == "buy milk"
+    _edit(second, _add("Bob", "0672223344"))
+    report, _ = _sync(first, second)
+    assert report["contacts"] == (0, 1)
+    assert _phones(first) == _phones(second) == {"Ann": "0501112233", "Bob": "0672223344"}
+
+
+def test_in_sync_replicas_compare_only_roots(replicas):
+    first, second = replicas
+    report, comparisons = _sync(first, second)
+    assert report == {"contacts": (0, 0), "notes": (0, 0)}
+    assert comparisons == len(ReplicaState.STORES)
+
+
+def test_delete_is_replicated(replicas):
+    first, second = replicas
+    _edit(second, lambda contacts, notes: contacts.pop("Ann"))
+    report, _ = _sync(first, second)
+    assert report["contacts"] == (0, 1)
+    assert _phones(first) == _phones(second) == {}
+    # tombstone keeps deleted record from coming back
+    _sync(second, first)
+    assert _phones(first) == {}
+
+
+def test_change_made_without_events_is_found(replicas):
+    first, second = replicas
+    storage = Pickle(str(first))
+    contacts = storage.read_contacts()
+    with contacts.edit("Ann") as record:
+        record.edit_phone("0509999999")
+    storage.save_contacts(contacts)
+    _sync(first, second)
+    assert _phones(second) == {"Ann": "0509999999"}
+
+
+@pytest.mark.parametrize("first_starts", [True, False])
+def test_newest_concurrent_edit_wins_on_both_sides(replicas, first_starts):
+    first, second = replicas
+    _edit(first, _change_phone("Ann", "0500000001"))
+    time.sleep(0.01)
+    _edit(second, _change_phone("Ann", "0500000002"))
+    if first_starts:
+        _sync(first, second)
+    else:
+        _sync(second, first)
+    assert _phones(first) == _phones(second) == {"Ann": "0500000002"}
+
+
+def test_edits_with_equal_time_have_the_same_winner(replicas, monkeypatch):
+    first, second = replicas
+    monkeypatch.setattr(time, "time", lambda: 4102444800.0)
+    _edit(first, _change_phone("Ann", "0500000001"))
+    _edit(second, _change_phone("Ann", "0500000002"))
+    stamps = [ReplicaState(Pickle(str(_))).versions["contacts"]["Ann"][0] for _ in (first, second)]
+    expected = "0500000001" if stamps[0] > stamps[1] else "0500000002"
+    _sync(second, first)
+    assert _phones(first) == _phones(second) == {"Ann": expected}
+
+
+def test_clock_stamps_grow_after_observe():
+    clock = HybridClock("node")
+    first = clock.tick()
+    clock.observe(HybridClock("other", clock.wall + 10 ** 6, 5).stamp())
+    second = clock.tick()
+    assert second > first
+    assert HybridClock.parse(second)[:2] == (clock.wall, 6)
+
+
+def test_merkle_diff_finds_only_changed_leaf():
+    versions = {f"name{_}": ["stamp", "digest"] for _ in range(1000)}
+    changed = dict(versions, name7=["newer", "digest"])
+    leaves, comparisons = MerkleTree(versions).diff(MerkleTree(changed))
+    assert leaves == {MerkleTree.leaf_of("name7")}
+    assert comparisons == 1 + MerkleTree.FANOUT * 2
+
+
+def test_merged_changes_keep_their_stamps(replicas):
+    first, _ = replicas
+    ours, theirs = Pickle(str(first)), Pickle(str(first))
+    contacts, state = theirs.read_contacts(), ReplicaState(theirs)
+    contacts.events.subscribe(state.stamp)
+    contacts.load()
+    _edit(first, _change_phone("Ann", "0500000001"))
+    stamp = ReplicaState(ours).versions["contacts"]["Ann"][0]
+    theirs.refresh_contacts(contacts)
+    assert contacts["Ann"].phone.value == "0500000001"
+    assert not state.dirty
+    replica = Replica(theirs, contacts, theirs.read_notes(), state)
+    replica.refresh()
+    assert state.versions["contacts"]["Ann"][0] == stamp
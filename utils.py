@@ -2,9 +2,37 @@
 """
 Utils, functions, classes for use it in main.py
 """
-import pickle
-from datetime import datetime
-from collections import UserDict
+import os
+import time
+import gc
+import heapq
+import threading
+import struct
+import copy
+import itertools
+from itertools import accumulate
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from collections import Counter, OrderedDict, UserDict, deque
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, saves there stay unlocked
+    fcntl = None
+
+
+@contextmanager
+def _gc_paused():
+    """ Disable cyclic garbage collector while lots of objects are created
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
 def input_error(func):
@@ -13,6 +41,9 @@ def input_error(func):
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except DataFileError:
+            # bot can not work with damaged data, it is reported by main
+            raise
         except TypeError:
             return "Please use correct number of arguments"
         except KeyError:
@@ -42,8 +73,565 @@ class Phone(Field):
     pass
 
 
-class AddressBook(UserDict):
-    pass
+NATIONAL_PHONE_LEN = 10
+
+
+def normalize_phone(phone: str):
+    """ Digits of national number, so +38(050)111-22-33 and 0501112233 are equal
+    :param phone: phone number
+    :type phone: str
+    :rtype: str
+    """
+    return "".join(_ for _ in str(phone) if _.isdigit())[-NATIONAL_PHONE_LEN:]
+
+
+class RWLock:
+    """ Reader-writer lock: readers share it, writer is exclusive.
+    New readers wait for waiting writer, so writers are not starved.
+    Thread which holds write lock may take it again for reading or writing,
+    upgrade of read lock to write lock is not allowed.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        """ Shared lock
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                owned = True
+            else:
+                owned = False
+                depth = getattr(self._local, "depth", 0)
+                if depth == 0:
+                    while self._writer is not None or self._waiting_writers:
+                        self._condition.wait()
+                    self._readers += 1
+                self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            if not owned:
+                with self._condition:
+                    self._local.depth -= 1
+                    if self._local.depth == 0:
+                        self._readers -= 1
+                        if self._readers == 0:
+                            self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Exclusive lock
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me:
+                if getattr(self._local, "depth", 0):
+                    raise RuntimeError("Read lock can not be upgraded to write lock")
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writes -= 1
+                if self._writes == 0:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+class LazyStore:
+    """ Mixin for UserDict containers which are read from file on first access of data
+    """
+
+    @classmethod
+    def lazy(cls, loader):
+        """ Create container which calls loader on first access
+        :param loader: callable which returns loaded container of the same class
+        :type loader: callable
+        :return: not loaded container
+        """
+        store = cls.__new__(cls)
+        store._loader = loader
+        return store
+
+    @property
+    def loaded(self):
+        """ Was data already loaded
+        :rtype: bool
+        """
+        return "data" in self.__dict__
+
+    _load_lock = threading.RLock()
+
+    def __getattr__(self, item):
+        loader = self.__dict__.get("_loader")
+        if loader is not None and item in ("data", "generation"):
+            with self._load_lock:
+                if "_loader" in self.__dict__:
+                    # attributes set before load (lock, transaction) stay as they are
+                    for name, value in vars(loader()).items():
+                        self.__dict__.setdefault(name, value)
+                    del self.__dict__["_loader"]
+            return getattr(self, item)
+        if item == "generation":
+            # bumped by Pickle on every save, lets other processes spot our writes
+            return 0
+        raise AttributeError(item)
+
+    def load(self):
+        """ Read data now if it was not read yet
+        """
+        if not self.loaded:
+            self.__getattr__("data")
+
+    def __getstate__(self):
+        self.load()
+        return dict(vars(self))
+
+
+class Transactional:
+    """ Mixin for UserDict containers with begin/commit/rollback.
+    Undo log keeps copy of value of every key before its first change in transaction,
+    nested begin joins the outer transaction.
+    """
+
+    _MISSING = object()
+    _undo = None
+    _depth = 0
+
+    @property
+    def in_transaction(self):
+        """ Is transaction started
+        :rtype: bool
+        """
+        return self._undo is not None
+
+    def begin(self):
+        """ Start transaction or join already started one
+        """
+        if self._undo is None:
+            self._undo = {}
+        self._depth += 1
+
+    def log(self, key):
+        """ Save value of key in undo log before its first change in transaction
+        :param key: key of container
+        """
+        if self._undo is not None and key not in self._undo:
+            self._undo[key] = copy.deepcopy(self.data[key]) if key in self.data else self._MISSING
+
+    def modify(self, key):
+        """ Get value for in place changes, logged in transaction
+        :param key: key of container
+        :return: value of key
+        """
+        self.log(key)
+        return self.data[key]
+
+    def commit(self):
+        """ Finish transaction, only the outermost commit forgets undo log
+        :return: changed keys if transaction is finished, None for nested one
+        :rtype: set or None
+        """
+        if self._undo is None:
+            self._depth = 0
+            return None
+        self._depth -= 1
+        if self._depth > 0:
+            return None
+        changed = set(self._undo)
+        self._undo = None
+        return changed
+
+    def rollback(self):
+        """ Restore all values changed in transaction and finish it
+        :return: restored keys
+        :rtype: set
+        """
+        undo, self._undo, self._depth = self._undo or {}, None, 0
+        for key, value in undo.items():
+            if value is self._MISSING:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+        return set(undo)
+
+    def __setitem__(self, key, value):
+        self.log(key)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        self.log(key)
+        del self.data[key]
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("_undo", None)
+        state.pop("_depth", None)
+        state.pop("_blobs", None)
+        return state
+
+
+class ThreadSafe:
+    """ Mixin which guards UserDict container with RWLock.
+    Single operations lock themselves, iteration works on snapshot of keys.
+    Values from [] and items() are live objects: read several fields of them under read()
+    or take snapshot(), change values in place only in edit().
+    """
+
+    @property
+    def lock(self):
+        """ Lock of container
+        :rtype: RWLock
+        """
+        if "_lock" not in self.__dict__:
+            with LazyStore._load_lock:
+                self.__dict__.setdefault("_lock", RWLock())
+        return self.__dict__["_lock"]
+
+    def read(self):
+        """ Shared lock of container
+        """
+        return self.lock.read()
+
+    def write(self):
+        """ Exclusive lock of container
+        """
+        return self.lock.write()
+
+    @contextmanager
+    def edit(self, key):
+        """ Value for in place changes under exclusive lock, logged in transaction
+        :param key: key of container
+        """
+        with self.write():
+            yield self.modify(key)
+
+    def snapshot(self, key):
+        """ Consistent copy of value
+        :param key: key of container
+        """
+        with self.read():
+            return copy.deepcopy(self.data[key])
+
+    def begin(self):
+        with self.write():
+            super().begin()
+
+    def commit(self):
+        with self.write():
+            return super().commit()
+
+    def rollback(self):
+        with self.write():
+            return super().rollback()
+
+    def __getitem__(self, key):
+        with self.read():
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self.write():
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with self.write():
+            super().__delitem__(key)
+
+    def __contains__(self, key):
+        with self.read():
+            return key in self.data
+
+    def __len__(self):
+        with self.read():
+            return len(self.data)
+
+    def pop(self, key, *default):
+        with self.write():
+            return super().pop(key, *default)
+
+    def __iter__(self):
+        with self.read():
+            return iter(list(self.data))
+
+    def keys(self):
+        with self.read():
+            return list(self.data)
+
+    def values(self):
+        with self.read():
+            return list(self.data.values())
+
+    def items(self):
+        with self.read():
+            return list(self.data.items())
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("_lock", None)
+        return state
+
+
+class Event:
+    """ Change of one key of AddressBook or Notes, old and new values are copies.
+    Origin tells if change was made by this process or merged from file saved by other one
+    """
+
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+    LOCAL = "local"
+    MERGE = "merge"
+
+    def __init__(self, seq, store, kind, key, old, new, fields, origin=LOCAL):
+        self.seq = seq
+        self.store = store
+        self.kind = kind
+        self.key = key
+        self.old = old
+        self.new = new
+        self.fields = fields
+        self.origin = origin
+        self.time = time.time()
+
+    def to_dict(self):
+        """ Representation of event for json
+        :rtype: dict
+        """
+        codec_kind = Codec.NOTES if self.store == Notes.STORE else Codec.CONTACTS
+        columns = [_ for _, _field_class in Codec.LAYOUTS[codec_kind]]
+
+        def _values(value):
+            if value is None:
+                return None
+            return dict(zip(columns, Codec.row(codec_kind, self.key, value)))
+
+        return {"seq": self.seq, "store": self.store, "kind": self.kind, "key": self.key,
+                "fields": self.fields, "old": _values(self.old), "new": _values(self.new),
+                "origin": self.origin, "time": self.time, "pid": os.getpid()}
+
+    def __str__(self):
+        return f"{self.seq} {self.store} {self.kind} {self.key} {', '.join(self.fields)}"
+
+
+class EventBus:
+    """ Publishes events to subscribers and keeps the last HISTORY of them,
+    so consumers can tail changes by sequence number instead of polling files
+    """
+
+    HISTORY = 1000
+    # sequence numbers are common for all buses, so changes of stores can be ordered
+    _sequence = itertools.count(1)
+
+    def __init__(self, store):
+        self.store = store
+        self.seq = 0
+        self._subscribers = []
+        self._history = deque(maxlen=self.HISTORY)
+        self._condition = threading.Condition()
+
+    def subscribe(self, callback):
+        """ Call callback(event) after every change
+        :param callback: subscriber
+        :type callback: callable
+        :return: callback, for unsubscribe
+        """
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """ Stop calling callback
+        :param callback: subscriber
+        :type callback: callable
+        """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def publish(self, kind, key, old, new, fields, origin=Event.LOCAL):
+        """ Create event and deliver it to subscribers
+        :return: published event
+        :rtype: Event
+        """
+        with self._condition:
+            self.seq = next(self._sequence)
+            event = Event(self.seq, self.store, kind, key, old, new, fields, origin)
+            self._history.append(event)
+            self._condition.notify_all()
+        for callback in list(self._subscribers):
+            callback(event)
+        return event
+
+    def tail(self, after=0, timeout=None):
+        """ Events with sequence number bigger than after, waits for them up to timeout seconds
+        :param after: last seen sequence number
+        :type after: int
+        :param timeout: seconds to wait for new events, no waiting if None
+        :type timeout: float
+        :return: list of events, the oldest first
+        :rtype: list
+        """
+        with self._condition:
+            if timeout is not None:
+                self._condition.wait_for(lambda: self.seq > after, timeout)
+            return [_ for _ in self._history if _.seq > after]
+
+
+class ChangeJournal:
+    """ Subscriber which appends events as json lines to rotating file,
+    so other processes can tail changes of store. Processes of one directory
+    share the file: lines are appended and the file is rotated under fcntl lock,
+    lock file keeps the last sequence number, so numbers in journal are unique
+    """
+
+    MAX_BYTES = 1024 * 1024
+    BACKUP_COUNT = 3
+    LOCK_SUFFIX = '.lock'
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    @contextmanager
+    def _next_seq(self):
+        """ Exclusive lock of journal with the next sequence number
+        :return: sequence number, saved when lock is released
+        :rtype: int
+        """
+        with open(self.file_name + self.LOCK_SUFFIX, "a+", encoding="utf-8") as _lock:
+            if fcntl is not None:
+                fcntl.flock(_lock, fcntl.LOCK_EX)
+            try:
+                _lock.seek(0)
+                last = _lock.read().strip()
+                seq = int(last) + 1 if last.isdigit() else 1
+                yield seq
+                _lock.truncate(0)
+                _lock.write(str(seq))
+            finally:
+                _lock.flush()
+                if fcntl is not None:
+                    fcntl.flock(_lock, fcntl.LOCK_UN)
+
+    def _rotate(self, size):
+        """ Move full journal to backups before line of size bytes is appended
+        """
+        try:
+            if os.path.getsize(self.file_name) + size <= self.MAX_BYTES:
+                return
+        except FileNotFoundError:
+            return
+        for index in range(self.BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f"{self.file_name}.{index}"):
+                os.replace(f"{self.file_name}.{index}", f"{self.file_name}.{index + 1}")
+        os.replace(self.file_name, f"{self.file_name}.1")
+
+    def write(self, event):
+        """ Append event to journal, changes merged from other processes
+        are already written by them
+        :param event: change
+        :type event: Event
+        """
+        if event.origin == Event.MERGE:
+            return
+        import json
+        content = event.to_dict()
+        with self._next_seq() as seq:
+            content["seq"] = seq
+            line = (json.dumps(content, ensure_ascii=False) + "\n").encode("utf-8", "surrogatepass")
+            self._rotate(len(line))
+            with open(self.file_name, "ab") as _file:
+                _file.write(line)
+
+
+class Observable:
+    """ Mixin which publishes Event for every insert, update and delete of
+    container, including rollback and merge of changes of other processes
+    """
+
+    STORE = None
+
+    @property
+    def events(self):
+        """ Bus of changes of container
+        :rtype: EventBus
+        """
+        if "_events" not in self.__dict__:
+            with LazyStore._load_lock:
+                self.__dict__.setdefault("_events", EventBus(self.STORE))
+        return self.__dict__["_events"]
+
+    def publish(self, key, old, new, origin=Event.LOCAL):
+        """ Publish change of key, nothing is published if value is the same
+        :param key: key of container
+        :param old: copy of value before change or None
+        :param new: value after change or None
+        :param origin: Event.LOCAL or Event.MERGE for changes of other processes
+        :type origin: str
+        """
+        if old is None and new is None:
+            return
+        if old is None:
+            kind, fields = Event.INSERT, []
+        elif new is None:
+            kind, fields = Event.DELETE, []
+        else:
+            codec_kind = Codec.kind_of(self)
+            columns = [_ for _, _field_class in Codec.LAYOUTS[codec_kind]]
+            fields = [column for column, before, after in zip(
+                columns, Codec.row(codec_kind, key, old), Codec.row(codec_kind, key, new)) if before != after]
+            if not fields:
+                return
+            kind = Event.UPDATE
+        self.events.publish(kind, key, old, copy.deepcopy(new), fields, origin)
+
+    @contextmanager
+    def edit(self, key):
+        with self.write():
+            old = copy.deepcopy(self.data.get(key))
+            with super().edit(key) as value:
+                yield value
+            self.publish(key, old, self.data.get(key))
+
+    def rollback(self):
+        with self.write():
+            current = {key: copy.deepcopy(self.data.get(key)) for key in (self._undo or {})}
+            restored = super().rollback()
+            for key in restored:
+                self.publish(key, current[key], self.data.get(key))
+            return restored
+
+    def __setitem__(self, key, value):
+        with self.write():
+            old = copy.deepcopy(self.data.get(key))
+            super().__setitem__(key, value)
+            self.publish(key, old, value)
+
+    def __delitem__(self, key):
+        with self.write():
+            old = copy.deepcopy(self.data.get(key))
+            super().__delitem__(key)
+            self.publish(key, old, None)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("_events", None)
+        return state
+
+
+class AddressBook(Observable, ThreadSafe, Transactional, LazyStore, UserDict):
+    STORE = "contacts"
 
 
 class Address(Field):
@@ -173,76 +761,711 @@ class Record:
         return f"Contact name: {self.name.value},{birthday} phone: {self.phone}, address: {self.address}"
 
 
-class Notes(UserDict):
+class BirthdayScheduler:
+    """ Min-heap of next birthday occurrences of contacts.
+    Heap is advanced lazily when days pass, entries of changed or deleted
+    records are dropped when they reach the top of heap.
+    Heap is changed by contact events, reminders and maintenance from different
+    threads, so public methods hold read lock of contacts and then reentrant
+    lock of scheduler, in the same order as events which come under write lock of contacts.
+    """
+
+    def __init__(self, contacts: AddressBook = None, today=None):
+        self.contacts = contacts if contacts is not None else AddressBook()
+        self._lock = threading.RLock()
+        self._heap = []
+        self._current = {}
+        self._seq = 0
+        self._reminded = set()
+        self._today = today or datetime.today().date()
+        self.rebuild()
+
+    def attach(self, contacts: AddressBook):
+        """ Switch scheduler to another address book
+        :param contacts: contacts object
+        """
+        self.contacts = contacts
+        self.rebuild()
+
+    @contextmanager
+    def _locked(self):
+        with self.contacts.read(), self._lock:
+            yield
+
+    @staticmethod
+    def anniversary(birthday, year):
+        """ Birthday date in given year, 29 of February goes to 28 in non leap years
+        :param birthday: date of birth
+        :type birthday: date
+        :param year: year of anniversary
+        :type year: int
+        :rtype: date
+        """
+        try:
+            return birthday.replace(year=year)
+        except ValueError:
+            return date(year, 2, 28)
+
+    @classmethod
+    def next_occurrence(cls, birthday, after):
+        """ First anniversary of birthday on or after given day
+        :param birthday: date of birth
+        :type birthday: date
+        :param after: start day
+        :type after: date
+        :rtype: date
+        """
+        day = cls.anniversary(birthday, after.year)
+        if day < after:
+            day = cls.anniversary(birthday, after.year + 1)
+        return day
+
+    @staticmethod
+    def congratulation_date(day):
+        """ Birthdays on weekend are congratulated on Monday
+        :param day: birthday date
+        :type day: date
+        :rtype: date
+        """
+        if day.weekday() in [5, 6]:
+            return day + timedelta(days=7 - day.weekday())
+        return day
+
+    def rebuild(self):
+        """ Build heap from scratch for all contacts
+        """
+        with self._locked():
+            self._heap = []
+            self._current = {}
+            for record in self.contacts.values():
+                self.schedule(record, _heapify=False)
+            heapq.heapify(self._heap)
+
+    def schedule(self, record, _heapify=True):
+        """ Add or replace next occurrence of record birthday
+        :param record: contact
+        :type record: Record
+        """
+        with self._locked():
+            name = record.name.value
+            self._current.pop(name, None)
+            birthday = record.birthday.date_object if record.birthday else None
+            if birthday is None:
+                return
+            self._seq += 1
+            self._current[name] = self._seq
+            entry = (self.next_occurrence(birthday, self._today), name, self._seq, record.birthday.value)
+            if _heapify:
+                heapq.heappush(self._heap, entry)
+            else:
+                self._heap.append(entry)
+            if len(self._heap) > 2 * len(self._current) + 16:
+                self._compact()
+
+    def unschedule(self, name):
+        """ Forget birthday of record, its heap entries become stale
+        :param name: name of contact
+        :type name: str
+        """
+        with self._locked():
+            self._current.pop(name, None)
+
+    def _is_valid(self, entry):
+        _, name, seq, value = entry
+        record = self.contacts.get(name)
+        return (self._current.get(name) == seq and record is not None
+                and record.birthday is not None and record.birthday.value == value)
+
+    def _compact(self):
+        self._heap = [_ for _ in self._heap if self._is_valid(_)]
+        heapq.heapify(self._heap)
+
+    def advance(self, today=None):
+        """ Move past occurrences to the next year, only touches heap top
+        :param today: current day, system date by default
+        :type today: date
+        """
+        with self._locked():
+            self._today = today or datetime.today().date()
+            while self._heap and self._heap[0][0] < self._today:
+                entry = heapq.heappop(self._heap)
+                if not self._is_valid(entry):
+                    continue
+                day, name, seq, value = entry
+                self._reminded.discard((name, day))
+                birthday = Birthday.convert_date(value)
+                heapq.heappush(self._heap, (self.next_occurrence(birthday, self._today), name, seq, value))
+
+    def _until(self, end):
+        """ Walk heap entries with date not later than end, skipping the rest subtrees
+        """
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if i >= len(self._heap) or self._heap[i][0] > end:
+                continue
+            if self._is_valid(self._heap[i]):
+                yield self._heap[i]
+            stack += [2 * i + 1, 2 * i + 2]
+
+    def between(self, start, end, today=None):
+        """ All birthdays from start to end inclusive. Heap keeps occurrences from today,
+        so range which starts before today is checked for all contacts
+        :param start: first day of range
+        :type start: date
+        :param end: last day of range
+        :type end: date
+        :return: sorted list of (date, name)
+        :rtype: list
+        """
+        with self._locked():
+            self.advance(today)
+            result = []
+            if start < self._today:
+                entries = [_ for _ in self._heap if self._is_valid(_)]
+            else:
+                entries = self._until(end)
+            for _, name, _, value in entries:
+                birthday = Birthday.convert_date(value)
+                day = self.next_occurrence(birthday, start)
+                while day <= end:
+                    result.append((day, name))
+                    day = self.next_occurrence(birthday, day + timedelta(days=1))
+            return sorted(result)
+
+    def reminders(self, days_before=0, today=None):
+        """ Birthdays which were not reminded yet, in days_before days from today
+        :param days_before: how many days before birthday remind
+        :type days_before: int
+        :return: list of reminder strings
+        :rtype: list
+        """
+        with self._locked():
+            self.advance(today)
+            result = []
+            for day, name in self.between(self._today, self._today + timedelta(days=days_before), self._today):
+                if (name, day) not in self._reminded:
+                    self._reminded.add((name, day))
+                    when = "today" if day == self._today else f"on {day.strftime(Birthday.date_format)}"
+                    result.append(f"Reminder: {name} has birthday {when}")
+            return result
+
+
+class ContactStats:
+    """ Counters of contacts per email domain, per phone operator prefix and of
+    birthdays per month. Counters are updated by contact events, so report does
+    not scan address book, and are saved with generation of contacts they match.
+    """
+
+    EMAIL_DOMAIN = "email.domain"
+    PHONE_PREFIX = "phone.prefix"
+    BIRTHDAY_MONTH = "birthday.month"
+    PREFIX_LEN = 3
+
+    def __init__(self, counters=None, generation=None):
+        self.counters = {_: Counter() for _ in (self.EMAIL_DOMAIN, self.PHONE_PREFIX, self.BIRTHDAY_MONTH)}
+        for name, counter in (counters or {}).items():
+            self.counters[name].update(counter)
+        # generation of contacts which counters match, None if unknown
+        self.generation = generation
+        self.dirty = False
+
+    def attach(self, contacts: AddressBook, saved=None):
+        """ Use saved counters for contacts, contacts are counted again only if
+        counters were saved for another generation of contacts
+        :param contacts: contacts object
+        :param saved: counters read from file
+        :type saved: ContactStats
+        """
+        if saved is not None and saved.generation is not None and saved.generation == contacts.generation:
+            self.counters, self.generation = saved.counters, saved.generation
+            self.dirty = False
+        else:
+            self.rebuild(contacts)
+
+    def rebuild(self, contacts: AddressBook):
+        """ Count all contacts from scratch
+        :param contacts: contacts object
+        """
+        for counter in self.counters.values():
+            counter.clear()
+        with contacts.read():
+            for record in contacts.data.values():
+                self.add(record)
+            self.generation = contacts.generation
+        self.dirty = True
+
+    @classmethod
+    def phone_prefix(cls, phone: str):
+        """ Operator code of phone: first digits of national number,
+        so +380501112233 and 0501112233 have the same prefix 050
+        :param phone: phone number
+        :type phone: str
+        :rtype: str
+        """
+        return normalize_phone(phone)[:cls.PREFIX_LEN]
+
+    @classmethod
+    def keys(cls, record):
+        """ Key of record in every counter
+        :param record: contact
+        :type record: Record
+        :return: counter name -> key, empty fields are not counted
+        :rtype: dict
+        """
+        keys = {}
+        if record.email is not None:
+            keys[cls.EMAIL_DOMAIN] = str(record.email.value).strip().lower().rpartition("@")[2]
+        if record.phone is not None:
+            keys[cls.PHONE_PREFIX] = cls.phone_prefix(record.phone.value)
+        if record.birthday is not None and record.birthday.date_object is not None:
+            keys[cls.BIRTHDAY_MONTH] = record.birthday.date_object.month
+        return {name: key for name, key in keys.items() if key}
+
+    def add(self, record, count=1):
+        """ Count record
+        :param record: contact
+        :type record: Record
+        :param count: 1 to add record, -1 to remove it
+        :type count: int
+        """
+        for name, key in self.keys(record).items():
+            counter = self.counters[name]
+            counter[key] += count
+            if counter[key] <= 0:
+                del counter[key]
+        self.dirty = True
+
+    def remove(self, record):
+        """ Stop counting record
+        :param record: contact
+        :type record: Record
+        """
+        self.add(record, -1)
+
+    def update(self, event: Event):
+        """ Subscriber of contact events, moves changed record between keys
+        :param event: change of contact
+        :type event: Event
+        """
+        if event.old is not None:
+            self.remove(event.old)
+        if event.new is not None:
+            self.add(event.new)
+
+    def to_dict(self):
+        """ Representation of counters for json
+        :rtype: dict
+        """
+        return {"generation": self.generation,
+                "counters": {name: {str(key): count for key, count in counter.items()}
+                             for name, counter in self.counters.items()}}
+
+    @classmethod
+    def from_dict(cls, content):
+        """ Counters from json representation
+        :param content: result of to_dict
+        :type content: dict
+        :rtype: ContactStats
+        """
+        counters = dict(content["counters"])
+        counters[cls.BIRTHDAY_MONTH] = {int(key): count for key, count in counters[cls.BIRTHDAY_MONTH].items()}
+        return cls(counters, content["generation"])
+
+
+class BlobStore:
+    """ Content addressed storage of note texts: file name is hash of text,
+    so equal texts are stored once and a saved text is never rewritten.
+    Without directory texts are kept in memory.
+    """
+
+    CACHE_SIZE = 64
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._memory = {}
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def key(text: str):
+        """ Hash of text
+        :rtype: str
+        """
+        import hashlib
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def put(self, text: str):
+        """ Save text if it is not saved yet, saved text gets new mtime,
+        so collect of other process does not delete it as old one
+        :param text: note text
+        :type text: str
+        :return: key of text
+        :rtype: str
+        """
+        key = self.key(text)
+        if self.directory is None:
+            self._memory[key] = text
+            return key
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as _file:
+                _file.write(text.encode("utf-8", "surrogatepass"))
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key: str):
+        """ Read text, recently read texts are cached
+        :param key: key of text
+        :type key: str
+        :rtype: str
+        """
+        if self.directory is None:
+            return self._memory[key]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        with open(self._path(key), "rb") as _file:
+            text = _file.read().decode("utf-8", "surrogatepass")
+        self._cache[key] = text
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return text
+
+    def collect(self, keys, grace=3600):
+        """ Delete texts which are not in keys and older than grace seconds,
+        younger ones can be used by notes of other processes not merged yet
+        :param keys: keys of used texts
+        :type keys: set
+        :param grace: age of text in seconds
+        :type grace: int
+        :return: count of deleted texts
+        :rtype: int
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return 0
+        deleted = 0
+        expired = time.time() - grace
+        for folder in os.listdir(self.directory):
+            for name in os.listdir(os.path.join(self.directory, folder)):
+                path = os.path.join(self.directory, folder, name)
+                if folder + name not in keys and os.stat(path).st_mtime < expired:
+                    os.remove(path)
+                    deleted += 1
+        return deleted
+
+
+class Notes(Observable, ThreadSafe, Transactional, LazyStore, UserDict):
+    """ Notes index: name -> key of text in blobs and tags,
+    texts are read only when they are shown
+    """
+
+    STORE = "notes"
+
+    @property
+    def blobs(self):
+        """ Storage of note texts, in memory one if not set
+        :rtype: BlobStore
+        """
+        self.load()
+        if "_blobs" not in self.__dict__:
+            self.__dict__["_blobs"] = BlobStore()
+        return self.__dict__["_blobs"]
+
+    @blobs.setter
+    def blobs(self, value):
+        self.__dict__["_blobs"] = value
+
+    def externalize(self):
+        """ Move texts of notes saved by old versions inside notes file to blobs
+        """
+        with self.write():
+            for note in self.data.values():
+                if "text" in note:
+                    note["blob"] = self.blobs.put(note.pop("text"))
+
+    def text(self, name):
+        """ Method for read text of note
+        """
+        with self.read():
+            note = self.data[name]
+            if "text" in note:
+                return note["text"]
+            blob = note["blob"]
+        return self.blobs.get(blob)
+
     def add_note(self, name, text):
         """ Method for add note
         """
-        self.data[name] = {"text": text, "tags": []}
+        self[name] = {"blob": self.blobs.put(text), "tags": []}
 
     def add_tags(self, name, tags):
         """ Method for add tags
         """
-        self.data[name]["tags"] += tags.split(" ")
+        with self.edit(name) as note:
+            note["tags"] += tags.split(" ")
 
     def find_note(self, name):
         """ Method for find note
         """
-        if name in self.data:
-            return f"Note`s name: {name},\ntags: {' '.join(t for t in self.data[name]['tags'])};" \
-                   f"\ntext: {self.data[name]['text']}\n"
+        with self.read():
+            if name in self.data:
+                return f"Note`s name: {name},\ntags: {' '.join(t for t in self.data[name]['tags'])};" \
+                       f"\ntext: {self.text(name)}\n"
 
     def delete_note(self, name):
         """ Method for delete note
         """
-        if name in self.data:
-            del self.data[name]
-            return True
-        else:
-            return False
+        with self.write():
+            if name in self.data:
+                del self[name]
+                return True
+            else:
+                return False
 
     def edit_note(self, name, new_text):
         """ Method for edit note
         """
-        if name in self.data:
-            self.data[name]["text"] = new_text
-            return True
-        else:
-            return False
+        with self.write():
+            if name in self.data:
+                with self.edit(name) as note:
+                    note.pop("text", None)
+                    note["blob"] = self.blobs.put(new_text)
+                return True
+            else:
+                return False
 
     def find_notes_by_tag(self, tag):
-        """ Method for find notes by tag
+        """ Method for find notes by tag, found notes are copies
         """
         matching_notes = dict()
-        for name, data in self.data.items():
-            tags = data["tags"]
-            if tag in tags:
-                matching_notes[name] = data
+        with self.read():
+            for name, data in self.data.items():
+                tags = data["tags"]
+                if tag in tags:
+                    matching_notes[name] = copy.deepcopy(data)
         return matching_notes
 
     def sort_notes(self):
-        """ Method for sort notes
+        """ Method for sort notes, sorted notes are copies
         """
-        sorted_notes = sorted(
-            self.data.items(), key=lambda item: (-len(item[1]["tags"]), item[0])
-        )
+        with self.read():
+            sorted_notes = sorted(
+                copy.deepcopy(self.data).items(), key=lambda item: (-len(item[1]["tags"]), item[0])
+            )
         return dict(sorted_notes)
     
 
+class DataFileError(ValueError):
+    pass
+
+
+class Codec:
+    """ Schema versioned binary format of AddressBook and Notes.
+    File is a header, names of columns, int32 length of every value (-1 for None)
+    and all values as one utf-8 text, so nothing from file is ever executed.
+    Columns are read by name: unknown ones are skipped, absent ones are None.
+    """
+
+    MAGIC = b"CCDB"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHBQII")
+    CONTACTS = 1
+    NOTES = 2
+    SEPARATOR = "\x1f"
+    ERRORS = "surrogatepass"
+    LAYOUTS = {
+        CONTACTS: (("name", Name), ("phone", Phone), ("birthday", Birthday), ("address", Address), ("email", Email)),
+        # text column is filled only in files of version 1, newer ones keep texts in BlobStore
+        NOTES: (("name", None), ("blob", None), ("tags", None), ("text", None)),
+    }
+    # version -> function(columns, values) which returns columns and values of version + 1,
+    # versions which only add columns need no migration
+    MIGRATIONS = {}
+
+    @classmethod
+    def kind_of(cls, data):
+        """ Kind of container
+        :param data: AddressBook or Notes
+        :rtype: int
+        """
+        return cls.NOTES if isinstance(data, Notes) else cls.CONTACTS
+
+    @classmethod
+    def row(cls, kind, key, value):
+        """ Values of columns for one Record or note
+        :param kind: CONTACTS or NOTES
+        :type kind: int
+        :return: tuple of str or None
+        :rtype: tuple
+        """
+        if kind == cls.NOTES:
+            return (key, value.get("blob"), cls.SEPARATOR.join(value["tags"]) if value["tags"] else None,
+                    value.get("text"))
+        return tuple(None if _ is None else str(_.value) for _ in
+                     (value.name, value.phone, value.birthday, value.address, value.email))
+
+    @classmethod
+    def _build(cls, kind, row):
+        """ Create Record or note from values of columns
+        :return: key and value for container
+        :rtype: tuple
+        """
+        if kind == cls.NOTES:
+            name, blob, tags, text = row
+            note = {"blob": blob} if blob is not None else {"text": text or ""}
+            note["tags"] = tags.split(cls.SEPARATOR) if tags is not None else []
+            return name, note
+        record = Record.__new__(Record)
+        for (field, field_class), value in zip(cls.LAYOUTS[cls.CONTACTS], row):
+            setattr(record, field, None if value is None else field_class(value))
+        return record.name.value, record
+
+    @classmethod
+    def dumps(cls, data):
+        """ Encode container
+        :param data: AddressBook or Notes
+        :return: encoded data
+        :rtype: bytes
+        """
+        kind = cls.kind_of(data)
+        columns = [_ for _, _field_class in cls.LAYOUTS[kind]]
+        values = [_ for key, value in data.data.items() for _ in cls.row(kind, key, value)]
+        lengths = [-1 if _ is None else len(_) for _ in values]
+        return b"".join([
+            cls.HEADER.pack(cls.MAGIC, cls.VERSION, kind, data.generation, len(data.data), len(columns)),
+            b"".join(bytes([len(_)]) + _.encode("ascii") for _ in columns),
+            struct.pack(f"<{len(lengths)}i", *lengths),
+            "".join(_ for _ in values if _ is not None).encode("utf-8", cls.ERRORS),
+        ])
+
+    @classmethod
+    def loads(cls, content):
+        """ Decode container
+        :param content: encoded data
+        :type content: bytes
+        :return: AddressBook or Notes
+        :raise DataFileError: if content is not encoded data or is truncated
+        """
+        if content[:len(cls.MAGIC)] != cls.MAGIC:
+            raise DataFileError("Data file has unknown format")
+        try:
+            _, version, kind, generation, rows, width = cls.HEADER.unpack_from(content)
+            if kind not in cls.LAYOUTS:
+                raise DataFileError(f"Data file has unknown kind {kind}")
+            if width == 0:
+                raise DataFileError("Data file is damaged: it has no columns")
+            offset = cls.HEADER.size
+            columns = []
+            for _ in range(width):
+                size = content[offset]
+                columns.append(content[offset + 1:offset + 1 + size].decode("ascii"))
+                offset += 1 + size
+            lengths = struct.unpack_from(f"<{rows * width}i", content, offset)
+            text = content[offset + 4 * rows * width:].decode("utf-8", cls.ERRORS)
+        except (struct.error, IndexError, UnicodeDecodeError) as ex:
+            raise DataFileError(f"Data file is damaged: {ex}") from None
+        if sum(max(_, 0) for _ in lengths) != len(text):
+            raise DataFileError("Data file is damaged: values are truncated")
+        ends = accumulate(max(_, 0) for _ in lengths)
+        values = [None if length < 0 else text[end - length:end] for length, end in zip(lengths, ends)]
+        for _version in range(version, cls.VERSION):
+            if _version in cls.MIGRATIONS:
+                columns, values = cls.MIGRATIONS[_version](columns, values)
+        positions = [columns.index(_) if _ in columns else None for _, _field_class in cls.LAYOUTS[kind]]
+        if positions[0] is None:
+            raise DataFileError("Data file is damaged: it has no name column")
+        data = Notes() if kind == cls.NOTES else AddressBook()
+        data.generation = generation
+        width = len(columns)
+        try:
+            with _gc_paused():
+                for start in range(0, len(values), width):
+                    key, value = cls._build(kind, [None if _ is None else values[start + _] for _ in positions])
+                    data.data[key] = value
+        except (ValueError, IndexError, AttributeError, TypeError) as ex:
+            raise DataFileError(f"Data file is damaged: {ex}") from None
+        return data
+
+    @classmethod
+    def digest(cls, kind, key, value):
+        """ Short digest of one Record or note, used to find changed keys
+        :rtype: bytes
+        """
+        import hashlib
+        text = cls.SEPARATOR.join("\x00" if _ is None else _ for _ in cls.row(kind, key, value))
+        return hashlib.blake2b(text.encode("utf-8", cls.ERRORS), digest_size=16).digest()
+
+
+# classes of address book which may be read from old pickle files
+LEGACY_CLASSES = {"Field", "Name", "Phone", "Address", "Email", "Birthday", "Record", "AddressBook", "Notes"}
+
+
+def legacy_unpickler(_file):
+    """ Reader of old pickle files which allows only classes of address book,
+    so no code from data file is executed during migration. pickle is imported
+    here, as it is needed only for migration
+    :param _file: pickle file opened in binary mode
+    :return: pickle.Unpickler
+    """
+    import pickle
+
+    class LegacyUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            if module in ("utils", "__main__") and name in LEGACY_CLASSES:
+                return globals()[name]
+            raise pickle.UnpicklingError(f"{module}.{name} is not allowed in data file")
+
+    return LegacyUnpickler(_file)
+
+
 class Pickle:
+    """ Storage of AddressBook and Notes in Codec format, name is kept
+    for compatibility, pickle is used only to migrate legacy files
+    """
 
-    NOTES = 'notes.pickle'
-    CONTACTS = 'contacts.pickle'
+    NOTES = 'notes.bin'
+    NOTES_BLOBS = 'notes.blobs'
+    CHANGES = 'changes.log'
+    CONTACTS = 'contacts.bin'
+    CONTACTS_STATS = 'contacts.stats'
+    LEGACY = {NOTES: 'notes.pickle', CONTACTS: 'contacts.pickle'}
+    LOCK_SUFFIX = '.lock'
+
+    def __init__(self, directory=""):
+        # directory of files, current one by default
+        self.directory = directory
+        # file name -> (st_mtime_ns, st_size, generation) of the last seen file
+        self._stamps = {}
+        # file name -> {key: digest} of the last state synced with the file
+        self._digests = {}
+
+    def path(self, file_name):
+        """ Path of file in directory of storage
+        :param file_name: one of file names of storage
+        :type file_name: str
+        :rtype: str
+        """
+        return os.path.join(self.directory, file_name)
 
     @staticmethod
     def save_to_file(file_name, data):
-        """ Method for save pickled data in file
+        """ Method for save encoded data in file
         :param file_name: name of file
         :type file_name: str
         :param data: any kind of data
         :type data: any
         """
-        with open(file_name, "wb") as _file:
-            pickle.dump(data, _file)
+        tmp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(tmp_name, "wb") as _file:
+            _file.write(Codec.dumps(data))
+        os.replace(tmp_name, file_name)
 
     @staticmethod
     def read_from_file(file_name):
@@ -253,34 +1476,275 @@ class Pickle:
         :rtype: any
         """
         with open(file_name, "rb") as _file:
-            content = pickle.load(_file)
+            try:
+                content = Codec.loads(_file.read())
+            except DataFileError as ex:
+                raise DataFileError(f"{file_name}: {ex}") from None
         return content
 
+    @staticmethod
+    def read_legacy_file(file_name):
+        """ Method for read old pickle file with allowed classes only
+        :param file_name: name of file
+        :type file_name: str
+        :return: data
+        :rtype: any
+        :raise DataFileError: if file has not allowed classes or is damaged
+        """
+        import pickle
+        with open(file_name, "rb") as _file:
+            try:
+                content = legacy_unpickler(_file).load()
+            except (pickle.UnpicklingError, EOFError) as ex:
+                raise DataFileError(f"Legacy data file {file_name} is not loaded: {ex}") from None
+        return content
+
+    @contextmanager
+    def locked(self, file_name, exclusive=True):
+        """ Advisory fcntl lock on the side file of file_name
+        :param file_name: name of data file
+        :type file_name: str
+        :param exclusive: exclusive lock for writers, shared for readers
+        :type exclusive: bool
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(file_name + self.LOCK_SUFFIX, "a") as _lock:
+            fcntl.flock(_lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(_lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _file_stamp(file_name):
+        """ Cheap change marker of file
+        :return: (st_mtime_ns, st_size) or None if file is absent
+        :rtype: tuple or None
+        """
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _digest_map(data):
+        """ Digest of every value in container, used to find changed keys
+        :param data: AddressBook or Notes
+        :return: {key: digest}
+        :rtype: dict
+        """
+        kind = Codec.kind_of(data)
+        with data.read():
+            return {key: Codec.digest(kind, key, value) for key, value in data.data.items()}
+
+    def _remember(self, file_name, data):
+        """ Store stamp and digests of data which is equal to file content
+        """
+        self._stamps[file_name] = (*(self._file_stamp(file_name) or (None, None)),
+                                   data.generation)
+        self._digests[file_name] = self._digest_map(data)
+
+    def _merge(self, file_name, data, disk):
+        """ Apply to data only the keys which were changed in disk copy since
+        last sync, keys changed locally win
+        :param data: container in memory, updated in place
+        :param disk: container read from file
+        :return: count of merged keys
+        :rtype: int
+        """
+        base = self._digests.get(file_name, {})
+        remote = self._digest_map(disk)
+        merged = 0
+        with data.write():
+            local = self._digest_map(data)
+            for key in set(base) | set(remote):
+                if local.get(key) != base.get(key) or remote.get(key) == base.get(key):
+                    continue
+                old = copy.deepcopy(data.data.get(key))
+                if key in remote:
+                    data.data[key] = disk.data[key]
+                else:
+                    data.data.pop(key, None)
+                data.publish(key, old, data.data.get(key), Event.MERGE)
+                merged += 1
+            data.generation = max(data.generation, disk.generation)
+        return merged
+
+    def _changed_on_disk(self, file_name):
+        """ Check mtime and size of file against the last seen ones
+        :rtype: bool
+        """
+        stamp = self._file_stamp(file_name)
+        return stamp is not None and stamp != self._stamps.get(file_name, (None, None, 0))[:2]
+
+    def save(self, file_name, data):
+        """ Save data under exclusive lock, merging changes of other processes first.
+        In transaction saving is postponed till commit, not loaded data has nothing to save
+        :param file_name: name of file
+        :type file_name: str
+        :param data: AddressBook or Notes
+        """
+        if not data.loaded or data.in_transaction:
+            return
+        with self.locked(file_name):
+            if self._changed_on_disk(file_name):
+                disk = self.read_from_file(file_name)
+                if disk.generation != self._stamps.get(file_name, (None, None, 0))[2]:
+                    self._merge(file_name, data, disk)
+            with data.write():
+                data.generation = data.generation + 1
+            with data.read():
+                self.save_to_file(file_name, data)
+                self._remember(file_name, data)
+
+    def load(self, file_name, factory):
+        """ Read data under shared lock
+        :param file_name: name of file
+        :type file_name: str
+        :param factory: class of empty container if file is absent
+        :return: AddressBook or Notes
+        """
+        with self.locked(file_name, exclusive=False):
+            try:
+                data = self.read_from_file(file_name)
+            except FileNotFoundError:
+                try:
+                    # saved in new format on next save
+                    data = self.read_legacy_file(os.path.join(
+                        os.path.dirname(file_name), self.LEGACY[os.path.basename(file_name)]))
+                except FileNotFoundError:
+                    data = factory()
+            self._remember(file_name, data)
+        return data
+
+    def refresh(self, file_name, data):
+        """ Merge in changes made by other processes, cheap if file is unchanged
+        or data is not loaded yet
+        :param file_name: name of file
+        :type file_name: str
+        :param data: AddressBook or Notes, updated in place
+        :return: count of merged keys
+        :rtype: int
+        """
+        if not data.loaded or not self._changed_on_disk(file_name):
+            return 0
+        with self.locked(file_name, exclusive=False):
+            disk = self.read_from_file(file_name)
+            merged = 0
+            if disk.generation != self._stamps.get(file_name, (None, None, 0))[2]:
+                merged = self._merge(file_name, data, disk)
+            self._remember(file_name, disk)
+        return merged
+
+    @contextmanager
+    def transaction(self, file_name, data):
+        """ Group changes of data in one transaction with one save on commit,
+        all changes are rolled back on exception
+        :param file_name: name of file
+        :type file_name: str
+        :param data: AddressBook or Notes
+        """
+        data.begin()
+        try:
+            yield data
+        except BaseException:
+            data.rollback()
+            raise
+        if data.commit():
+            self.save(file_name, data)
+
+    def contacts_transaction(self, data):
+        """ Method for transaction on contacts
+        """
+        return self.transaction(self.path(self.CONTACTS), data)
+
+    def notes_transaction(self, data):
+        """ Method for transaction on notes
+        """
+        return self.transaction(self.path(self.NOTES), data)
+
     def save_notes(self, data):
         """ Method for save notes
         """
-        self.save_to_file(self.NOTES, data)
+        self.save(self.path(self.NOTES), data)
 
     def read_notes(self):
-        """ Method for read notes
+        """ Method for read notes, file is read on first access, texts are read
+        from blobs when needed
         """
-        try:
-            return self.read_from_file(self.NOTES)
-        except FileNotFoundError:
-            return Notes()
+        return Notes.lazy(lambda: self._with_blobs(self.load(self.path(self.NOTES), Notes)))
+
+    def _with_blobs(self, notes):
+        """ Connect notes to texts storage
+        """
+        notes.blobs = BlobStore(self.path(self.NOTES_BLOBS))
+        notes.externalize()
+        return notes
+
+    def collect_blobs(self, notes):
+        """ Method for delete texts of deleted and edited notes, notes saved by
+        other processes are merged first and can not be saved till texts are deleted
+        """
+        file_name = self.path(self.NOTES)
+        with self.locked(file_name, exclusive=False):
+            self.refresh(file_name, notes)
+            with notes.read():
+                keys = {_["blob"] for _ in notes.data.values() if "blob" in _}
+            return notes.blobs.collect(keys)
+
+    def refresh_notes(self, data):
+        """ Method for merge notes changed by other processes
+        """
+        return self.refresh(self.path(self.NOTES), data)
 
     def save_contacts(self, data):
         """ Method for save contacts
         """
-        self.save_to_file(self.CONTACTS, data)
+        self.save(self.path(self.CONTACTS), data)
 
     def read_contacts(self):
-        """ Method for read notes
+        """ Method for read contacts, file is read on first access
+        """
+        return AddressBook.lazy(lambda: self.load(self.path(self.CONTACTS), AddressBook))
+
+    def refresh_contacts(self, data):
+        """ Method for merge contacts changed by other processes
         """
+        return self.refresh(self.path(self.CONTACTS), data)
+
+    def save_contact_stats(self, stats: ContactStats, contacts: AddressBook):
+        """ Method for save counters of contacts next to contacts file,
+        counters of not saved changes are not saved
+        """
+        if stats.generation is None or not contacts.loaded or contacts.in_transaction:
+            return
+        if not stats.dirty and stats.generation == contacts.generation:
+            return
+        import json
+        file_name = self.path(self.CONTACTS_STATS)
+        with contacts.read():
+            stats.generation = contacts.generation
+            content = json.dumps(stats.to_dict(), ensure_ascii=False)
+        tmp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(tmp_name, "w", encoding="utf-8") as _file:
+            _file.write(content)
+        os.replace(tmp_name, file_name)
+        stats.dirty = False
+
+    def read_contact_stats(self):
+        """ Method for read counters of contacts, empty counters of unknown
+        generation if file is absent or broken
+        :rtype: ContactStats
+        """
+        import json
         try:
-            return self.read_from_file(self.CONTACTS)
-        except FileNotFoundError:
-            return AddressBook()
+            with open(self.path(self.CONTACTS_STATS), "r", encoding="utf-8") as _file:
+                return ContactStats.from_dict(json.load(_file))
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return ContactStats()
 
 
 class CommandCompleter:
@@ -330,6 +1794,17 @@ class Commands:
     EDIT_NOTE = "edit-note"
     FIND_NOTES_BY_TAGS = "find-by-tag"
     SORT_NOTES = "show-sorted-notes"
+    QUERY = "query"
+    EXPLAIN = "explain"
+    DEDUPE = "dedupe"
+    MERGE = "merge"
+    CHANGES = "changes"
+    BEGIN = "begin"
+    COMMIT = "commit"
+    ROLLBACK = "rollback"
+    BIRTHDAYS = "birthdays"
+    SYNC = "sync"
+    STATS_CONTACTS = "stats-contacts"
 
     @classmethod
     def all_keys(cls):